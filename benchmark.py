@@ -0,0 +1,265 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+# --- ベンチマーク ---
+# エンジンごと・設定ごとに、別プロセスで 1秒あたりのゲーム数、ピークメモリ、起動時間 (モジュール読み込み + 台の生成) を測る。
+# 結果は JSON のベースライン (benchmarks/baseline.json) と比較し、閾値を超えて遅く・重くなったものを報告する。
+# jit は Numba があればコンパイルしたカーネル、なければ Python エンジンそのものを測る (同じ同等性検定を通す)。
+# さらにコンパイル前のカーネルを RandomStream の乱数で実行し、同じシードの spin() と統計が完全に一致するかを確かめる
+# (jit_engine.verify_kernel)。Numba 内蔵の乱数では spin() と結果が一致しないので、抽選の順序はこちらで確認する。
+# 同じ実行で出率の同等性検定も行う: バッチごとの出率から標準誤差を求め、厳密解との差の90%信頼区間が
+# ±margin (デフォルト±0.5%) に収まれば同等 (TOST)、それ以外は失敗にする。信頼区間全体が ±margin の外なら不一致、
+# どちらでもなければゲーム数が足りず「判定不能」だが、これも失敗扱い (--allow-inconclusive で注記だけにする)。
+# ゲーム数を省略すると、ベースラインの標準誤差から90%信頼区間の半幅が margin の1/3 になるゲーム数を設定ごとに見積もる。
+# 出率の分散が大きいので、±0.5% で判定するには1エンジンあたり数千万〜1億ゲーム以上かかる。速くても結果が違うエンジンはここで失敗する。
+# terminal は terminal_graph_simulator のオブザーバー (連荘とクレジット履歴) を購読した spin を測る。
+# オブザーバーは乱数を使わないので、出率が python と完全に一致しなければオブザーバーが結果を変えている。
+
+ENGINES = ("python", "terminal", "numpy", "fastforward", "jit")
+OBSERVED_ENGINES = ("terminal",)
+BATCHES = 20
+NUMPY_MACHINES, NUMPY_WARMUP = 1000, 2000
+KERNEL_CHECK_GAMES = 200_000
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmarks", "baseline.json")
+TOST_Z = 1.645  # 片側5% x 2 = 90% 信頼区間
+TARGET_HALF_WIDTH = 1 / 3  # margin に対する90%信頼区間の半幅の目標
+DEFAULT_GAMES, MIN_GAMES = 100_000_000, 1_000_000  # ベースラインがないときのゲーム数と見積もりの下限
+
+def peak_memory_mb():
+    # Linux の ru_maxrss は exec 前の親プロセスの値を引き継ぐため、/proc の VmHWM を使う
+    if os.path.exists("/proc/self/status"):
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    import resource
+    # macOS の ru_maxrss はバイト単位
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1024 * 1024)
+
+def bench_spin_engine(setting, games, seed, observed=False):
+    # spin() を1ゲームずつ呼ぶエンジン。戻り値は (起動時間, 実行時間, バッチごとの出率)
+    start = time.perf_counter()
+    import simulation_runner
+    spin = simulation_runner.spin
+    if observed:
+        from credit_history import CreditHistory
+        from terminal_graph_simulator import CreditRecorder, RenchanTracker
+        spin = simulation_runner.observed_spin([RenchanTracker(), CreditRecorder(CreditHistory())])
+    from rng import RandomStream
+    state = simulation_runner.GameState(setting_level=setting, rng=RandomStream(seed))
+    startup = time.perf_counter() - start
+    rates, batch_games = [], games // BATCHES
+    start = time.perf_counter()
+    for _ in range(BATCHES):
+        payout_before = state.total_payout
+        for _ in range(batch_games):
+            spin(state, verbose=False)
+        rates.append((state.total_payout - payout_before) / (batch_games * 3))
+    return startup, time.perf_counter() - start, rates
+
+def bench_numpy(setting, games, seed):
+    start = time.perf_counter()
+    import numpy as np
+    import numpy_engine
+    state = numpy_engine.BatchGameState(NUMPY_MACHINES, setting_level=setting, rng=np.random.default_rng(seed))
+    startup = time.perf_counter() - start
+    # リセット直後の影響を除くため、ウォームアップは計測と同等性検定から外す (台ごとの出率を標本にする)
+    for _ in range(NUMPY_WARMUP):
+        numpy_engine.spin(state)
+    payout_before = state.total_payout.copy()
+    steps = max(1, games // NUMPY_MACHINES)
+    start = time.perf_counter()
+    for _ in range(steps):
+        numpy_engine.spin(state)
+    elapsed = time.perf_counter() - start
+    return startup, elapsed, list((state.total_payout - payout_before) / (steps * 3)), steps * NUMPY_MACHINES
+
+def bench_fastforward(setting, games, seed):
+    start = time.perf_counter()
+    import numpy as np
+    import fast_forward
+    rng = np.random.default_rng(seed)
+    state = fast_forward.new_state(setting, rng)
+    tables = fast_forward.GapTables(state.setting)
+    startup = time.perf_counter() - start
+    rates, batch_games = [], games // BATCHES
+    start = time.perf_counter()
+    for batch in range(1, BATCHES + 1):
+        payout_before = state.total_payout
+        while state.total_games < batch * batch_games:
+            fast_forward.advance(state, tables, rng, batch * batch_games - state.total_games)
+        rates.append((state.total_payout - payout_before) / (batch_games * 3))
+    return startup, time.perf_counter() - start, rates
+
+def bench_jit(setting, games, seed):
+    # 起動時間には JIT コンパイル (キャッシュがあれば読み込み) を含める
+    start = time.perf_counter()
+    import jit_engine
+    if jit_engine.numba is None:
+        return bench_spin_engine(setting, games, seed)
+    from rng import RandomStream
+    from simulation_runner import compile_rules
+    jit_engine.seed_kernel(seed)
+    rules = compile_rules(setting)
+    tables = jit_engine.build_tables(rules)
+    state = jit_engine.new_state(rules, jit_engine.initial_mode(RandomStream(seed)))
+    jit_engine.run_block(state.copy(), 1, *tables)
+    startup = time.perf_counter() - start
+    rates, batch_games = [], games // BATCHES
+    start = time.perf_counter()
+    for _ in range(BATCHES):
+        payout_before = state[jit_engine.S_PAYOUT]
+        jit_engine.run_block(state, batch_games, *tables)
+        rates.append((state[jit_engine.S_PAYOUT] - payout_before) / jit_engine.PAYOUT_SCALE / (batch_games * 3))
+    return startup, time.perf_counter() - start, rates
+
+def run_worker(engine, setting, games, seed):
+    played = games // BATCHES * BATCHES
+    if engine == "numpy":
+        startup, elapsed, rates, played = bench_numpy(setting, games, seed)
+    elif engine == "fastforward":
+        startup, elapsed, rates = bench_fastforward(setting, games, seed)
+    elif engine == "jit":
+        startup, elapsed, rates = bench_jit(setting, games, seed)
+    else:
+        startup, elapsed, rates = bench_spin_engine(setting, games, seed, observed=engine == "terminal")
+    mean = sum(rates) / len(rates)
+    variance = sum((rate - mean) ** 2 for rate in rates) / (len(rates) - 1)
+    result = {
+        "spins_per_sec": played / elapsed,
+        "peak_mb": peak_memory_mb(),
+        "startup_s": startup,
+        "payout_rate": mean,
+        "standard_error": (variance / len(rates)) ** 0.5,
+        "games": played,
+    }
+    if engine == "jit":
+        import jit_engine
+        result["backend"] = jit_engine.BACKEND
+        # 計測が終わってから行う (ピークメモリと速度には含めない)
+        result["kernel_matches_spin"] = jit_engine.verify_kernel(setting, KERNEL_CHECK_GAMES, seed)
+    return result
+
+def measure(engine, setting, games, seed):
+    # ピークメモリと起動時間を他の計測から切り離すため、1つずつ別プロセスで実行する
+    output = subprocess.run([sys.executable, os.path.abspath(__file__), "--worker", engine, str(setting), str(games), str(seed)],
+                            capture_output=True, text=True, check=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+    return json.loads(output.stdout.strip().splitlines()[-1])
+
+def check_equivalence(result, exact_rate, margin):
+    # 戻り値は ("equivalent" | "different" | "inconclusive", 差, 90%信頼区間の半幅)
+    diff = result["payout_rate"] - exact_rate
+    half_width = TOST_Z * result["standard_error"]
+    if abs(diff) + half_width <= margin:
+        return "equivalent", diff, half_width
+    if abs(diff) - half_width > margin:
+        return "different", diff, half_width
+    return "inconclusive", diff, half_width
+
+def planned_games(baseline, setting, margin):
+    # 標準誤差は 1/sqrt(ゲーム数) で縮むので、ベースラインの中で一番大きい標準誤差から必要なゲーム数を逆算する。
+    # 同じ設定のエンジンはすべて同じゲーム数で回す (terminal と python の出率の完全一致を確かめるため)
+    needed = []
+    for by_setting in baseline.get("results", {}).values():
+        base = by_setting.get(str(setting))
+        if base:
+            games = base.get("games", baseline.get("games"))
+            needed.append(games * (TOST_Z * base["standard_error"] / (margin * TARGET_HALF_WIDTH)) ** 2)
+    if not needed:
+        return DEFAULT_GAMES
+    return max(MIN_GAMES, -(-int(max(needed)) // BATCHES) * BATCHES)
+
+def check_regressions(result, baseline, threshold):
+    problems = []
+    if result["spins_per_sec"] < baseline["spins_per_sec"] * (1 - threshold):
+        problems.append(f"spins/sec {baseline['spins_per_sec']:,.0f} -> {result['spins_per_sec']:,.0f}")
+    if result["peak_mb"] > baseline["peak_mb"] * (1 + threshold):
+        problems.append(f"peak memory {baseline['peak_mb']:.1f}MB -> {result['peak_mb']:.1f}MB")
+    # 起動時間は短いので、50ms 未満の増加は誤差とみなす
+    if result["startup_s"] > baseline["startup_s"] * (1 + threshold) and result["startup_s"] - baseline["startup_s"] > 0.05:
+        problems.append(f"startup {baseline['startup_s']:.3f}s -> {result['startup_s']:.3f}s")
+    return problems
+
+def run_benchmarks(engines, settings, games, seed, baseline_path, threshold, margin, update_baseline, allow_inconclusive=False):
+    import markov_solver
+    baseline = {}
+    if os.path.exists(baseline_path):
+        with open(baseline_path, encoding="utf-8") as f:
+            baseline = json.load(f)
+    results, failures = {}, 0
+    print(f"{'Engine':>12} {'Set':>3} {'Spins/s':>12} {'Peak MB':>8} {'Start s':>8} {'Payout':>8} {'Exact':>8} {'Diff±90%CI':>16}  Status")
+    for setting in settings:
+        exact_rate = markov_solver.solve(setting)["payout_rate"]
+        setting_games = games or planned_games(baseline, setting, margin)
+        print(f"{'':>12} {setting:>3} {setting_games:,} games per engine")
+        for engine in engines:
+            result = measure(engine, setting, setting_games, seed)
+            results.setdefault(engine, {})[str(setting)] = result
+            verdict, diff, half_width = check_equivalence(result, exact_rate, margin)
+            problems, notes = [], []
+            if verdict == "different" or (verdict == "inconclusive" and not allow_inconclusive):
+                problems.append(f"payout not equivalent to exact within ±{margin:.2%} ({verdict})")
+            elif verdict == "inconclusive":
+                notes.append("equivalence inconclusive, allowed by --allow-inconclusive")
+            if "backend" in result:
+                notes.append(f"backend: {result['backend']}")
+            reference = results.get("python", {}).get(str(setting))
+            if engine in OBSERVED_ENGINES and reference and result["payout_rate"] != reference["payout_rate"]:
+                problems.append("observers changed the result of spin()")
+            if result.get("kernel_matches_spin") is False:
+                problems.append("un-jitted kernel does not reproduce spin()")
+            base = baseline.get("results", {}).get(engine, {}).get(str(setting))
+            if base and not update_baseline:
+                problems += check_regressions(result, base, threshold)
+            failures += bool(problems)
+            status = ("OK" if not problems else "FAIL: " + "; ".join(problems)) + "".join(f" ({note})" for note in notes)
+            print(f"{engine:>12} {setting:>3} {result['spins_per_sec']:>12,.0f} {result['peak_mb']:>8.1f} {result['startup_s']:>8.3f} "
+                  f"{result['payout_rate']:>8.2%} {exact_rate:>8.2%} {f'{diff:+.2%}±{half_width:.2%}':>16}  {status}")
+
+    if update_baseline:
+        merged = baseline.get("results", {})
+        for engine, by_setting in results.items():
+            merged.setdefault(engine, {}).update(by_setting)
+        os.makedirs(os.path.dirname(baseline_path), exist_ok=True)
+        with open(baseline_path, "w", encoding="utf-8") as f:
+            json.dump({"games": games or baseline.get("games"), "python": platform.python_version(), "machine": platform.platform(), "results": merged},
+                      f, indent=2, sort_keys=True)
+        print(f"\nBaseline written to {baseline_path}")
+    print(f"\n{failures} failure(s)")
+    return failures
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Benchmark the engines and check that their payout rates agree with the exact solution.")
+    parser.add_argument("--engines", nargs="+", choices=ENGINES, default=list(ENGINES))
+    parser.add_argument("--settings", nargs="+", type=int, default=None)
+    parser.add_argument("--games", type=int, default=None,
+                        help="games per engine and setting (default: sized from the baseline so the equivalence test can decide)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--update-baseline", action="store_true")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed relative slowdown / growth")
+    parser.add_argument("--margin", type=float, default=0.005, help="equivalence margin for the payout rate")
+    parser.add_argument("--allow-inconclusive", action="store_true",
+                        help="do not fail when the equivalence test is inconclusive (quick speed-only runs)")
+    parser.add_argument("--worker", nargs=4, metavar=("ENGINE", "SETTING", "GAMES", "SEED"), help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+if __name__ == "__main__":
+    args = parse_args(sys.argv[1:])
+    if args.worker:
+        engine, setting, games, seed = args.worker
+        print(json.dumps(run_worker(engine, int(setting), int(games), int(seed))))
+        sys.exit(0)
+    from simulation_runner import SETTINGS
+    settings = args.settings or sorted(SETTINGS)
+    for setting in settings:
+        if setting not in SETTINGS:
+            print(f"Error: Setting level {setting} not found.")
+            sys.exit(1)
+    failures = run_benchmarks(args.engines, settings, args.games, args.seed, args.baseline, args.threshold, args.margin, args.update_baseline, args.allow_inconclusive)
+    sys.exit(1 if failures else 0)
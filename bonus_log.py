@@ -0,0 +1,132 @@
+import json
+import os
+import sys
+
+import numpy as np
+
+from simulation_runner import MODE_NAMES
+
+# --- ボーナス履歴のカラム形式ログ ---
+# ボーナス1回ごとに (総ゲーム数, BIG/REG, ボーナス間ゲーム数, 当選時のモード, ボーナス後のモード, 1G連, 中段チェリー) を
+# 列ごとの固定幅バイナリファイルに追記する。書き込みは NumPy のバッファにためて tofile() でまとめて行うので、
+# 1イベントごとの Python オブジェクトは残らない。読み込みは np.memmap なので、全体をメモリに載せずに集計できる。
+# ボーナスは終了時 (ボーナス後のモードが決まった時点) に記録する。終了前のボーナスは書き出さない。
+
+LOG_VERSION = 1
+COLUMNS = {
+    "game_index": "<i8",      # 当選したゲームの総ゲーム数
+    "is_big": "u1",
+    "games_since_bonus": "<i2",  # 1G連は0
+    "mode_before": "i1",
+    "mode_after": "i1",
+    "one_g_ren": "u1",
+    "middle_cherry": "u1",
+}
+META_FILE = "meta.json"
+
+class BonusEventLog:
+    def __init__(self, directory, buffer_size=65536):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.count = 0
+        self._buffers = {name: np.empty(buffer_size, dtype=dtype) for name, dtype in COLUMNS.items()}
+        self._fill = 0
+        self._pending = None  # 終了前のボーナス
+        self._files = {name: open(os.path.join(directory, f"{name}.bin"), "wb") for name in COLUMNS}
+        self._write_meta()
+
+    def append(self, game_index, is_big, games_since_bonus, mode_before, mode_after, one_g_ren, middle_cherry):
+        i, buffers = self._fill, self._buffers
+        buffers["game_index"][i] = game_index
+        buffers["is_big"][i] = is_big
+        buffers["games_since_bonus"][i] = games_since_bonus
+        buffers["mode_before"][i] = mode_before
+        buffers["mode_after"][i] = mode_after
+        buffers["one_g_ren"][i] = one_g_ren
+        buffers["middle_cherry"][i] = middle_cherry
+        self._fill += 1
+        if self._fill == len(buffers["game_index"]):
+            self.flush()
+
+    # オブザーバーのフック (simulation_runner.observed_spin)。記録しないときは購読しないので、通常の実行速度には影響しない。
+    def on_bonus_start(self, state, bonus_type, games_since_bonus, one_g_ren, middle_cherry):
+        # 1G連は前のボーナスの終了を兼ねる (ボーナス後のモードは当選時のまま)
+        self._record_pending(state.current_mode)
+        self._pending = (state.total_games, bonus_type == "BIG", games_since_bonus, state.current_mode, one_g_ren, middle_cherry)
+
+    def on_bonus_end(self, state, mode_before):
+        self._record_pending(state.current_mode)
+
+    def _record_pending(self, mode_after):
+        if self._pending is not None:
+            game_index, is_big, games_since_bonus, mode_before, one_g_ren, middle_cherry = self._pending
+            self.append(game_index, is_big, games_since_bonus, mode_before, mode_after, one_g_ren, middle_cherry)
+            self._pending = None
+
+    def flush(self):
+        if self._fill:
+            for name, f in self._files.items():
+                self._buffers[name][:self._fill].tofile(f)
+                f.flush()
+            self.count += self._fill
+            self._fill = 0
+        # 件数は列ファイルを書き終えてから更新するので、途中で止まっても meta.json の件数までは読める
+        self._write_meta()
+
+    def _write_meta(self):
+        temp_path = os.path.join(self.directory, META_FILE + ".tmp")
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump({"version": LOG_VERSION, "count": self.count, "columns": COLUMNS, "modes": MODE_NAMES}, f)
+        os.replace(temp_path, os.path.join(self.directory, META_FILE))
+
+    def close(self):
+        self.flush()
+        for f in self._files.values():
+            f.close()
+
+def load_bonus_log(directory):
+    # 列名 -> 読み取り専用の np.memmap
+    with open(os.path.join(directory, META_FILE), encoding="utf-8") as f:
+        meta = json.load(f)
+    if meta["version"] != LOG_VERSION:
+        raise ValueError(f"{directory} has an unsupported bonus log version.")
+    count = meta["count"]
+    if count == 0:
+        return {name: np.empty(0, dtype=dtype) for name, dtype in meta["columns"].items()}
+    return {name: np.memmap(os.path.join(directory, f"{name}.bin"), dtype=dtype, mode="r", shape=(count,))
+            for name, dtype in meta["columns"].items()}
+
+def summarize(directory, chunk_size=10_000_000):
+    # 全件を一度に読み込まず、チャンクごとに集計する
+    columns = load_bonus_log(directory)
+    count = len(columns["game_index"])
+    big, one_g_ren, middle_cherry, interval_sum, normal_bonuses = 0, 0, 0, 0, 0
+    transitions = np.zeros((len(MODE_NAMES), len(MODE_NAMES)), dtype=np.int64)
+    for start in range(0, count, chunk_size):
+        end = min(start + chunk_size, count)
+        is_ren = columns["one_g_ren"][start:end].astype(bool)
+        big += int(columns["is_big"][start:end].sum())
+        one_g_ren += int(is_ren.sum())
+        middle_cherry += int(columns["middle_cherry"][start:end].sum())
+        interval_sum += int(columns["games_since_bonus"][start:end][~is_ren].astype(np.int64).sum())
+        normal_bonuses += int((~is_ren).sum())
+        before = columns["mode_before"][start:end].astype(np.int64)
+        after = columns["mode_after"][start:end].astype(np.int64)
+        np.add.at(transitions, (before, after), 1)
+    print(f"\n--- Bonus Log: {directory} ({count:,} bonuses) ---")
+    if count == 0:
+        return
+    print(f"BIG: {big:,} ({big / count:.1%})  REG: {count - big:,}")
+    print(f"1G-ren: {one_g_ren:,}  Middle Cherry: {middle_cherry:,}")
+    if normal_bonuses:
+        print(f"Average games between bonuses (excluding 1G-ren): {interval_sum / normal_bonuses:.1f}")
+    print("\nMode at hit -> mode after bonus:")
+    print(f"{'':>16}" + "".join(f"{name:>16}" for name in MODE_NAMES))
+    for row, name in enumerate(MODE_NAMES):
+        print(f"{name:>16}" + "".join(f"{value:>16,}" for value in transitions[row]))
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print("Usage: python3 bonus_log.py LOG_DIRECTORY")
+        sys.exit(1)
+    summarize(sys.argv[1])
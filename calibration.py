@@ -0,0 +1,292 @@
+import argparse
+import hashlib
+import itertools
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import markov_solver
+from run_all_simulations import DEFAULT_CACHE_DIR
+from simulation_runner import (
+    MODE_CHANCE, MODE_DOKI_DOKI, MODE_NORMAL_A, MODE_NORMAL_B, MODE_SUPER_DOKI_DOKI, MODE_TENGOKU, MODE_TRANSITIONS,
+    SETTINGS, TENGOKU_PROB_TABLE, ruleset_hash,
+)
+
+# --- モード移行テーブルのパラメータースイープと較正 ---
+# 推定値のパラメーター (モード移行確率、天国突入時の昇格抽選の閾値、天国テーブルの倍率) を格子状に振り、
+# 各点の出率を markov_solver の厳密解で求める。1点1設定あたり0.1秒程度なので、run_simulation で統計誤差を
+# 十分小さくするより何桁も速く、モンテカルロ誤差もない。格子の点はプロセスプールで並列に評価し、結果は
+# ルールのハッシュとパラメーターをキーにディスクへキャッシュする (範囲を広げた再実行では新しい点だけを計算する)。
+# 目標出率 (--target) を与えると、二乗誤差が最小の格子点から Nelder-Mead で範囲内を探索して合わせ込む。
+#
+# パラメーター名:
+#   FROM.TO            MODE_TRANSITIONS[FROM][TO] (例: NORMAL_A.TENGOKU)。差分は FROM の自己ループ (なければ最後の移行先) が吸収する。
+#                      同じ FROM の移行先を複数振る場合は、振っていない移行先のうち同じ順で選んだものが吸収する
+#   promo_doki         simulation_runner.TENGOKU_PROMOTION のドキドキ昇格の閾値 (現在 0.08)
+#   promo_super_doki   同じく超ドキドキ昇格の閾値 (現在 0.005)
+#   tengoku_scale      TENGOKU_PROB_TABLE 全体に掛ける倍率 (現在のテーブルが 1.0)
+
+SOLVER_VERSION = 2
+PARAM_MODES = {
+    "NORMAL_A": MODE_NORMAL_A, "NORMAL_B": MODE_NORMAL_B, "CHANCE": MODE_CHANCE,
+    "TENGOKU": MODE_TENGOKU, "DOKI_DOKI": MODE_DOKI_DOKI, "SUPER_DOKI_DOKI": MODE_SUPER_DOKI_DOKI,
+}
+SCALAR_PARAMS = ("promo_doki", "promo_super_doki", "tengoku_scale")
+FIT_MAX_EVALUATIONS = 400
+
+def check_param_name(name):
+    if name in SCALAR_PARAMS:
+        return
+    source, _, target = name.partition(".")
+    if source not in PARAM_MODES or target not in PARAM_MODES:
+        raise ValueError(f"Unknown parameter '{name}'.")
+    if PARAM_MODES[source] not in MODE_TRANSITIONS:
+        raise ValueError(f"{source} has no mode transition table.")
+
+def parse_param(spec):
+    # NAME=LOW:HIGH:STEPS (両端を含む等間隔) または NAME=VALUE
+    name, _, values = spec.partition("=")
+    check_param_name(name)
+    parts = values.split(":")
+    if len(parts) == 1:
+        return name, [float(parts[0])]
+    if len(parts) != 3:
+        raise ValueError(f"Invalid range '{values}' (expected LOW:HIGH:STEPS).")
+    low, high, steps = float(parts[0]), float(parts[1]), int(parts[2])
+    if steps < 1 or low > high:
+        raise ValueError(f"Invalid range '{values}'.")
+    if steps == 1:
+        return name, [low]
+    return name, [low + (high - low) * i / (steps - 1) for i in range(steps)]
+
+def parse_target(spec):
+    setting, _, rate = spec.partition("=")
+    setting, rate = int(setting), float(rate)
+    if setting not in SETTINGS:
+        raise ValueError(f"Setting level {setting} not found.")
+    return setting, rate
+
+def transition_absorber(source, targets):
+    # 合計を1に戻すために調整する移行先: 自己ループ (なければ最後の移行先)。同じ行でスイープ中の移行先は使わない
+    row = MODE_TRANSITIONS[source]
+    candidates = [mode for mode in row if mode not in targets]
+    if not candidates:
+        raise ValueError(f"Every transition from {source} is swept; leave one to absorb the difference.")
+    return source if source in candidates else candidates[-1]
+
+def check_param_names(names):
+    # 同じ移行元の行をスイープするパラメーターが、吸収先を残しているか確認する
+    rows = {}
+    for name in names:
+        if name not in SCALAR_PARAMS:
+            source, target = name.split(".")
+            rows.setdefault(PARAM_MODES[source], set()).add(PARAM_MODES[target])
+    for source, targets in rows.items():
+        transition_absorber(source, targets)
+
+def set_transitions(transitions, source, values):
+    # transitions[source] の各移行先を values の値にして、合計が1になるよう吸収先で一度だけ調整する
+    row = transitions[source]
+    row.update(values)
+    absorber = transition_absorber(source, values)
+    row[absorber] = 0.0
+    row[absorber] = 1 - sum(row.values())
+    if any(prob < -1e-12 or prob > 1 + 1e-12 for prob in row.values()):
+        raise ValueError(f"Transition probabilities from {source} are out of range.")
+
+def build_overrides(params):
+    # パラメーター -> markov_solver.solve() のキーワード引数。実現できない組み合わせは ValueError
+    transitions = {mode: dict(table) for mode, table in MODE_TRANSITIONS.items()}
+    super_doki, doki = markov_solver.TENGOKU_PROMOTION
+    scale = 1.0
+    rows = {}
+    for name, value in params.items():
+        if name == "promo_doki": doki = value
+        elif name == "promo_super_doki": super_doki = value
+        elif name == "tengoku_scale": scale = value
+        else:
+            source, target = name.split(".")
+            rows.setdefault(PARAM_MODES[source], {})[PARAM_MODES[target]] = value
+    for source, values in rows.items():
+        set_transitions(transitions, source, values)
+    if not 0 <= super_doki <= doki <= 1:
+        raise ValueError("Promotion thresholds must satisfy 0 <= promo_super_doki <= promo_doki <= 1.")
+    table = [p * scale for p in TENGOKU_PROB_TABLE]
+    if scale < 0 or max(table) > 1:
+        raise ValueError("tengoku_scale makes a Tengoku table probability exceed 1.")
+    return {"mode_transitions": transitions, "promotion": (super_doki, doki), "tengoku_table": table}
+
+# --- 評価とキャッシュ ---
+
+def evaluation_key(setting, params):
+    payload = json.dumps(sorted(params.items()))
+    return hashlib.sha256(f"{SOLVER_VERSION}:{ruleset_hash(setting)}:{setting}:{payload}".encode("utf-8")).hexdigest()
+
+def cache_path(cache_dir, key):
+    return os.path.join(cache_dir, "calibration", key[:2], f"{key}.json")
+
+def load_evaluation(cache_dir, key):
+    try:
+        with open(cache_path(cache_dir, key), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def save_evaluation(cache_dir, key, result):
+    path = cache_path(cache_dir, key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        json.dump(result, f)
+    os.replace(temp_path, path)
+
+def evaluate(setting, params):
+    # ワーカープロセス側で実行される
+    return markov_solver.solve(setting, **build_overrides(params))
+
+def evaluate_points(points, settings, executor, cache_dir=None):
+    # 戻り値は points と同じ順の {設定: 厳密解} のリスト。キャッシュにない (点, 設定) だけを並列に計算する
+    results = [{} for _ in points]
+    missing = []
+    for i, params in enumerate(points):
+        for setting in settings:
+            key = evaluation_key(setting, params)
+            cached = load_evaluation(cache_dir, key) if cache_dir else None
+            if cached is not None:
+                results[i][setting] = cached
+            else:
+                missing.append((i, setting, key))
+    if missing:
+        chunksize = max(1, len(missing) // (8 * (os.cpu_count() or 1)))
+        solved = executor.map(evaluate, [setting for _, setting, _ in missing], [points[i] for i, _, _ in missing], chunksize=chunksize)
+        for (i, setting, key), result in zip(missing, solved):
+            results[i][setting] = result
+            if cache_dir:
+                save_evaluation(cache_dir, key, result)
+    return results, len(missing)
+
+def loss(result, targets):
+    return sum((result[setting]["payout_rate"] - rate) ** 2 for setting, rate in targets.items())
+
+# --- スイープと合わせ込み ---
+
+def run_sweep(ranges, settings, executor, cache_dir=None):
+    # 実現できない組み合わせ (確率の合計が1を超えるなど) は飛ばす
+    names = list(ranges)
+    points, skipped = [], 0
+    for values in itertools.product(*(ranges[name] for name in names)):
+        params = dict(zip(names, values))
+        try:
+            build_overrides(params)
+        except ValueError:
+            skipped += 1
+            continue
+        points.append(params)
+    start_time = time.time()
+    results, computed = evaluate_points(points, settings, executor, cache_dir)
+    print(f"  ... {len(points):,} points x {len(settings)} settings ({computed:,} solved, {len(points) * len(settings) - computed:,} cached, "
+          f"{skipped:,} infeasible skipped) in {time.time() - start_time:.1f}s")
+    return points, results
+
+def fit(start, bounds, settings, targets, executor, cache_dir=None, max_evaluations=FIT_MAX_EVALUATIONS):
+    # 格子の最良点から、範囲内で Nelder-Mead により二乗誤差を最小化する。各評価は設定ごとに並列に解く
+    from scipy.optimize import minimize
+    names = list(bounds)
+
+    def objective(x):
+        params = dict(zip(names, (float(v) for v in x)))
+        try:
+            build_overrides(params)
+        except ValueError:
+            return float("inf")
+        (result,), _ = evaluate_points([params], settings, executor, cache_dir)
+        return loss(result, targets)
+
+    fitted = minimize(objective, [start[name] for name in names], method="Nelder-Mead",
+                      bounds=[bounds[name] for name in names],
+                      options={"maxfev": max_evaluations, "xatol": 1e-6, "fatol": 1e-12})
+    return dict(zip(names, (float(v) for v in fitted.x))), fitted.nfev
+
+def format_params(params):
+    return " ".join(f"{name}={value:.6g}" for name, value in params.items())
+
+def print_point(params, result, targets):
+    rates = " ".join(f"S{setting}:{result[setting]['payout_rate']:.4%}" for setting in sorted(result))
+    error = f" rmse={(loss(result, targets) / len(targets)) ** 0.5:.4%}" if targets else ""
+    print(f"  {format_params(params)}  {rates}{error}")
+
+def print_patch(params):
+    # simulation_runner.py に反映するための値 (エンジンはすべて simulation_runner の定数を参照する)
+    overrides = build_overrides(params)
+    print("\nValues to apply:")
+    for mode, table in overrides["mode_transitions"].items():
+        if table != MODE_TRANSITIONS[mode]:
+            print(f"  MODE_TRANSITIONS[{mode!r}] = {{{', '.join(f'{target!r}: {prob:.4f}' for target, prob in table.items())}}}")
+    if "promo_super_doki" in params or "promo_doki" in params:
+        super_doki, doki = overrides["promotion"]
+        print(f"  TENGOKU_PROMOTION = ({super_doki:.4f}, {doki:.4f})")
+    if "tengoku_scale" in params:
+        print(f"  TENGOKU_PROB_TABLE: multiply by {params['tengoku_scale']:.4f} (the 1.1 factor becomes {1.1 * params['tengoku_scale']:.4f})")
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Sweep the estimated mode table parameters with the exact solver and fit them to target payout rates.")
+    parser.add_argument("--param", action="append", required=True, metavar="NAME=LOW:HIGH:STEPS",
+                        help="parameter range, e.g. NORMAL_A.TENGOKU=0.25:0.40:16, promo_doki=0.05:0.11:7, tengoku_scale=0.9:1.3:9")
+    parser.add_argument("--target", action="append", default=[], metavar="SETTING=RATE", help="target payout rate, e.g. 6=1.10")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--top", type=int, default=10)
+    parser.add_argument("--no-fit", action="store_true", help="only sweep the grid")
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR)
+    parser.add_argument("--no-cache", action="store_true")
+    parser.add_argument("--output", default=None, help="write every grid point to a CSV file")
+    return parser.parse_args(argv)
+
+if __name__ == "__main__":
+    args = parse_args(sys.argv[1:])
+    try:
+        ranges = dict(parse_param(spec) for spec in args.param)
+        check_param_names(ranges)
+        targets = dict(parse_target(spec) for spec in args.target)
+    except ValueError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+    settings = sorted(targets) or sorted(SETTINGS)
+    cache_dir = None if args.no_cache else args.cache_dir
+    grid_size = 1
+    for values in ranges.values():
+        grid_size *= len(values)
+    print(f"Sweeping {grid_size:,} points over settings {', '.join(map(str, settings))}")
+
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        points, results = run_sweep(ranges, settings, executor, cache_dir)
+        if not points:
+            print("Error: No feasible points in the grid.")
+            sys.exit(1)
+        if args.output:
+            with open(args.output, "w", encoding="utf-8") as f:
+                f.write(",".join(list(ranges) + [f"setting_{setting}" for setting in settings]) + "\n")
+                for params, result in zip(points, results):
+                    f.write(",".join([f"{params[name]:.10g}" for name in ranges] + [f"{result[setting]['payout_rate']:.10g}" for setting in settings]) + "\n")
+            print(f"Grid written to {args.output}")
+
+        order = sorted(range(len(points)), key=lambda i: loss(results[i], targets)) if targets else range(len(points))
+        print(f"\n--- {'Best' if targets else 'First'} {min(args.top, len(points))} grid points ---")
+        for i in list(order)[:args.top]:
+            print_point(points[i], results[i], targets)
+
+        if targets and not args.no_fit:
+            best = points[next(iter(order))]
+            # 値が1つだけのパラメーターは固定し、範囲のあるものだけを動かす
+            bounds = {name: (min(values), max(values)) for name, values in ranges.items() if len(values) > 1}
+            fixed = {name: values[0] for name, values in ranges.items() if len(values) == 1}
+            if bounds:
+                start_time = time.time()
+                fitted, evaluations = fit({name: best[name] for name in bounds}, bounds, settings, targets, executor, cache_dir)
+                params = {**fixed, **fitted}
+                (result,), _ = evaluate_points([params], settings, executor, cache_dir)
+                print(f"\n--- Fitted ({evaluations} evaluations, {time.time() - start_time:.1f}s) ---")
+                print_point(params, result, targets)
+                print("  targets: " + " ".join(f"S{setting}:{rate:.4%}" for setting, rate in sorted(targets.items())))
+                print_patch(params)
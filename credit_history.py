@@ -0,0 +1,55 @@
+from array import array
+
+# --- 固定サイズのクレジット履歴 ---
+# 一定ゲーム数ごとのバケットに最小値・最大値・最終値だけを残す。バケット数が上限に達したら
+# 隣り合う2つを統合してバケット幅を2倍にするので、メモリはゲーム数ではなくバケット数 (≒描画幅) に比例する。
+# 最小値・最大値を残すため、ドローダウンの底や連荘の山は間引いても消えない。
+
+class CreditHistory:
+    def __init__(self, max_buckets=1024):
+        if max_buckets < 2 or max_buckets % 2:
+            raise ValueError("max_buckets must be an even number >= 2")
+        self.max_buckets = max_buckets
+        self.bucket_size = 1
+        self.count = 0
+        self.mins, self.maxs, self.lasts = array("d"), array("d"), array("d")
+        # 書き込み中のバケット
+        self._fill, self._min, self._max, self._last = 0, 0.0, 0.0, 0.0
+
+    def append(self, value):
+        if self._fill == 0:
+            self._min = self._max = value
+        elif value < self._min:
+            self._min = value
+        elif value > self._max:
+            self._max = value
+        self._last = value
+        self._fill += 1
+        self.count += 1
+        if self._fill == self.bucket_size:
+            self._close_bucket()
+
+    def _close_bucket(self):
+        self.mins.append(self._min)
+        self.maxs.append(self._max)
+        self.lasts.append(self._last)
+        self._fill = 0
+        if len(self.mins) == self.max_buckets:
+            self._merge_buckets()
+
+    def _merge_buckets(self):
+        mins, maxs = self.mins, self.maxs
+        self.mins = array("d", map(min, mins[0::2], mins[1::2]))
+        self.maxs = array("d", map(max, maxs[0::2], maxs[1::2]))
+        self.lasts = self.lasts[1::2]
+        self.bucket_size *= 2
+
+    def buckets(self):
+        # (開始インデックス, 最小, 最大, 最終) のリスト。書き込み途中のバケットも含める
+        rows = [(i * self.bucket_size, lo, hi, last) for i, (lo, hi, last) in enumerate(zip(self.mins, self.maxs, self.lasts))]
+        if self._fill:
+            rows.append((len(self.mins) * self.bucket_size, self._min, self._max, self._last))
+        return rows
+
+    def __len__(self):
+        return len(self.mins) + (1 if self._fill else 0)
@@ -0,0 +1,111 @@
+import argparse
+import sys
+import time
+
+import numpy as np
+
+import numpy_engine
+from numpy_engine import DRAWS_PER_GAME, SMALL_ROLES, BatchGameState
+from simulation_runner import MEDALS_PER_SPIN, MIDDLE_CHERRY_PROB, SETTINGS
+
+# --- 共通乱数 (CRN) + 制御変量による設定間比較 ---
+# 全設定の BatchGameState を同じ一様乱数行列で進める。NumPy エンジンは抽選ごとに乱数の行が決まっているので、
+# 同じ台・同じゲームの同じ抽選には全設定で同じ乱数が使われ、設定間の差の分散が大きく減る。
+# さらに期待値が既知の量 (小役の払い出し、中段チェリーの当選回数) の実測値とのずれを制御変量として回帰で取り除く。
+# 台を独立な標本とみなし、独立に実行した場合の標準誤差との比を分散削減率として表示する。
+
+def snapshot(state):
+    koyaku_payout = sum(state.koyaku_counts[name] * state.koyaku_payout[i] for i, name in enumerate(SMALL_ROLES))
+    return {
+        "payout": state.total_payout.copy(),
+        "koyaku_payout": koyaku_payout,
+        "koyaku_draws": state.koyaku_draws.copy(),
+        "middle_cherry_hits": state.middle_cherry_hits.copy(),
+        "middle_cherry_draws": state.middle_cherry_draws.copy(),
+    }
+
+def machine_samples(state, start, games):
+    # 台ごとの出率と、期待値0の制御変量 (どちらも1ゲームあたりに正規化)
+    end = snapshot(state)
+    delta = {key: end[key] - start[key] for key in end}
+    role_probs = np.diff(np.concatenate(([0.0], state.koyaku_cumulative)))
+    koyaku_mean = role_probs @ state.koyaku_payout[:-1]
+    payout_rate = delta["payout"] / (games * MEDALS_PER_SPIN)
+    controls = np.column_stack([
+        (delta["koyaku_payout"] - delta["koyaku_draws"] * koyaku_mean) / (games * MEDALS_PER_SPIN),
+        (delta["middle_cherry_hits"] - delta["middle_cherry_draws"] * MIDDLE_CHERRY_PROB) / games,
+    ])
+    return payout_rate, controls
+
+def control_variate_residuals(samples, controls):
+    # 制御変量の係数を最小二乗で推定し、その分を差し引いた標本を返す
+    centered = controls - controls.mean(axis=0)
+    beta, *_ = np.linalg.lstsq(centered, samples - samples.mean(), rcond=None)
+    return samples - centered @ beta
+
+def standard_error(samples):
+    return samples.std(ddof=1) / np.sqrt(len(samples))
+
+def run_comparison(total_spins, machines, seed=None, warmup=2000, base_setting=1):
+    machines = max(2, min(machines, total_spins))
+    steps = max(1, total_spins // machines)
+    seed_sequence = np.random.SeedSequence(seed)
+    init_seed, draw_seed = seed_sequence.spawn(2)
+    # 初期モードの抽選も全設定で揃える
+    states = {level: BatchGameState(machines, setting_level=level, rng=np.random.default_rng(init_seed))
+              for level in sorted(SETTINGS)}
+    rng = np.random.default_rng(draw_seed)
+
+    start_time = time.time()
+    for _ in range(warmup):
+        u = rng.random((DRAWS_PER_GAME, machines))
+        for state in states.values():
+            numpy_engine.spin(state, u=u)
+    starts = {level: snapshot(state) for level, state in states.items()}
+    report_every = max(1, 1000000 // machines)
+    for step in range(steps):
+        if (step + 1) % report_every == 0:
+            print(f"  ... {(step + 1) * machines:,} games played per setting ({time.time() - start_time:.2f}s)")
+        u = rng.random((DRAWS_PER_GAME, machines))
+        for state in states.values():
+            numpy_engine.spin(state, u=u)
+
+    samples = {level: machine_samples(state, starts[level], steps) for level, state in states.items()}
+    print_comparison(samples, machines, steps, warmup, base_setting)
+
+def print_comparison(samples, machines, steps, warmup, base_setting):
+    print(f"\n--- CRN Setting Comparison ({machines:,} machines x {steps:,} games, {warmup:,} warm-up games) ---")
+    print(f"{'Setting':>8} {'Payout':>9} {'SE':>8}")
+    for level, (payout_rate, controls) in samples.items():
+        adjusted = control_variate_residuals(payout_rate, controls)
+        print(f"{level:>8} {adjusted.mean():>9.2%} {standard_error(adjusted):>8.3%}")
+
+    print(f"\n{'Diff':>8} {'Estimate':>9} {'SE(ind)':>8} {'SE(CRN)':>8} {'SE(+CV)':>8} {'VRF':>7}")
+    base_rate, base_controls = samples[base_setting]
+    for level, (payout_rate, controls) in samples.items():
+        if level == base_setting:
+            continue
+        diff = payout_rate - base_rate
+        adjusted = control_variate_residuals(diff, np.hstack([controls, base_controls]))
+        # 独立に実行した場合の標準誤差 (各設定の台ごとの分散の和)
+        independent_se = np.sqrt((payout_rate.var(ddof=1) + base_rate.var(ddof=1)) / len(diff))
+        vrf = (independent_se / standard_error(adjusted)) ** 2
+        print(f"{f'{level}-{base_setting}':>8} {adjusted.mean():>+9.2%} {independent_se:>8.3%} "
+              f"{standard_error(diff):>8.3%} {standard_error(adjusted):>8.3%} {vrf:>6.1f}x")
+    print("VRF: variance of independent runs / variance with CRN and control variates (same game count)")
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Compare settings with common random numbers and control variates.")
+    parser.add_argument("--games", type=int, default=10_000_000, help="games per setting")
+    parser.add_argument("--machines", type=int, default=2000)
+    parser.add_argument("--warmup", type=int, default=2000, help="warm-up games per machine excluded from the statistics")
+    parser.add_argument("--base", type=int, default=1, help="setting to compare against")
+    parser.add_argument("--seed", type=int, default=None)
+    return parser.parse_args(argv)
+
+if __name__ == "__main__":
+    args = parse_args(sys.argv[1:])
+    if args.base not in SETTINGS:
+        print(f"Error: Setting level {args.base} not found.")
+        sys.exit(1)
+    run_comparison(args.games, args.machines, seed=args.seed, warmup=args.warmup, base_setting=args.base)
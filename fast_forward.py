@@ -0,0 +1,171 @@
+import time
+from bisect import bisect_left, bisect_right
+
+import numpy as np
+
+from simulation_runner import (
+    BONUS_GAMES, BONUS_PAYOUT_PER_GAME, CHANCE, DOKI_DOKI, GAME_CEILING, KOYAKU, MIDDLE_CHERRY_PROB,
+    NORMAL_A, NORMAL_B, ONE_G_REN_PROB, RESET_MODE_SPLIT, SUPER_DOKI_DOKI, TENGOKU, TENGOKU_LIMIT, TENGOKU_PROB_TABLE,
+    TENGOKU_PROMOTION, TENGOKU_UPGRADE_PROB, THROUGH_CEILING, GameState, collect_stats, print_report,
+)
+
+# --- イベントスキップ (早送り) エンジン ---
+# 通常時のボーナス間ゲーム数を1回の抽選でまとめて決め、その間の小役は多項分布で一括抽選する。
+# ボーナス1回分の処理が O(ボーナス間ゲーム数) ではなく O(1) になる。ゲームごとの推移は記録しない。
+
+SMALL_ROLES = [name for name in KOYAKU if name != "GUARANTEED"]
+
+class GapTables:
+    def __init__(self, setting):
+        cherry_prob = setting["cherry_prob"]
+        bonus_prob = setting["bonus_prob"]
+        guaranteed_prob = KOYAKU["GUARANTEED"]["prob"]
+
+        # 1ゲームあたりの当選確率 (中段チェリー → 確定役 → 天国テーブル → 通常確率の順に抽選)
+        def hazard(tengoku_prob):
+            return 1 - (1 - MIDDLE_CHERRY_PROB) * (1 - guaranteed_prob) * (1 - tengoku_prob) * (1 - bonus_prob)
+
+        normal = [hazard(0.0)] * (GAME_CEILING - 1) + [1.0]
+        tengoku = [hazard(p) for p in TENGOKU_PROB_TABLE] + normal[TENGOKU_LIMIT:]
+        self.hazard = {False: normal, True: tengoku}
+        self.cdf = {False: self._cdf(normal), True: self._cdf(tengoku)}
+        self.middle_cherry_share = MIDDLE_CHERRY_PROB
+        self.guaranteed_share = MIDDLE_CHERRY_PROB + (1 - MIDDLE_CHERRY_PROB) * guaranteed_prob
+
+        probs = [cherry_prob if name == "CHERRY" else KOYAKU[name]["prob"] for name in SMALL_ROLES]
+        self.koyaku_probs = np.array(probs + [1 - sum(probs)])
+        self.koyaku_payout = np.array([KOYAKU[name]["payout"] for name in SMALL_ROLES] + [0])
+        self.upgrades = [(SMALL_ROLES.index(name), [p["SUPER_DOKI"], p["DOKI"] - p["SUPER_DOKI"], 1 - p["DOKI"]])
+                         for name, p in TENGOKU_UPGRADE_PROB.items()]
+        # ボーナス1ゲームあたりの1G連当選確率
+        self.one_g_ren_prob = cherry_prob * ONE_G_REN_PROB["CHERRY"] + KOYAKU["WATERMELON"]["prob"] * ONE_G_REN_PROB["WATERMELON"]
+
+    @staticmethod
+    def _cdf(hazards):
+        cdf, survival, total = [], 1.0, 0.0
+        for h in hazards:
+            total += survival * h
+            survival *= 1 - h
+            cdf.append(total)
+        cdf[-1] = 1.0
+        return cdf
+
+def draw_small_roles(state, tables, rng, games, tengoku):
+    counts = rng.multinomial(games, tables.koyaku_probs)
+    for i, name in enumerate(SMALL_ROLES):
+        if counts[i]: state.koyaku_counts[name] += int(counts[i])
+    payout = float(counts @ tables.koyaku_payout)
+    if not tengoku:
+        return payout
+
+    # 天国中のモード昇格抽選: 昇格回数は二項分布、最終モードは最後に昇格した役で決まる。
+    # 各ゲームは交換可能なので、最後の昇格は全昇格の中から一様に選ばれる。
+    doki, super_doki = 0, 0
+    for index, probs in tables.upgrades:
+        if counts[index]:
+            to_super, to_doki, _ = rng.multinomial(counts[index], probs)
+            super_doki += int(to_super)
+            doki += int(to_doki)
+    state.doki_doki_entries += doki
+    state.super_doki_doki_entries += super_doki
+    if doki + super_doki:
+        state.current_mode = SUPER_DOKI_DOKI if rng.random() * (doki + super_doki) < super_doki else DOKI_DOKI
+    return payout
+
+def advance_gap(state, tables, rng, budget):
+    tengoku = state.current_mode >= TENGOKU
+    if not tengoku and state.bonus_through_count >= THROUGH_CEILING:
+        games, forced = 1, True
+    else:
+        games = bisect_left(tables.cdf[tengoku], rng.random()) + 1
+        forced = games == GAME_CEILING
+    hit = games <= budget
+    if not hit:
+        games = budget
+
+    # 当選ゲームより前のゲームはすべて小役抽選のみ (天国中と転落後で分けて抽選)
+    misses = games - 1 if hit else games
+    tengoku_misses = min(misses, TENGOKU_LIMIT) if tengoku else 0
+    payout = 0.0
+    if tengoku_misses:
+        payout += draw_small_roles(state, tables, rng, tengoku_misses, True)
+    if misses - tengoku_misses:
+        payout += draw_small_roles(state, tables, rng, misses - tengoku_misses, False)
+    if tengoku and games > TENGOKU_LIMIT:
+        state.current_mode = NORMAL_A
+        state.bonus_through_count = 1
+
+    state.total_games += games
+    state.games_since_bonus += games
+    if hit:
+        if not forced:
+            share = rng.random() * tables.hazard[tengoku][games - 1]
+            if share < tables.middle_cherry_share:
+                state.middle_cherry_hits += 1
+                payout += 3
+            elif share < tables.guaranteed_share:
+                state.koyaku_counts["GUARANTEED"] += 1
+        bonus_type = "BIG" if rng.random() < state.rules.big_ratio[state.current_mode] else "REG"
+        state.bonus_count[bonus_type] += 1
+        state.games_since_bonus = 0
+        state.is_in_bonus_at = True
+        state.bonus_games_remaining = BONUS_GAMES[bonus_type]
+    state.total_payout += payout
+    return games
+
+def advance_bonus(state, tables, rng, budget):
+    games = min(state.bonus_games_remaining, budget)
+    state.total_games += games
+    state.total_payout += games * BONUS_PAYOUT_PER_GAME
+    if games < state.bonus_games_remaining:
+        state.bonus_games_remaining -= games
+        return games
+
+    state.is_in_bonus_at = False
+    state.bonus_games_remaining = 0
+    if rng.random() < 1 - (1 - tables.one_g_ren_prob) ** games:
+        state.bonus_count["BIG"] += 1
+        state.is_in_bonus_at = True
+        state.bonus_games_remaining = BONUS_GAMES["BIG"]
+        return games
+
+    previous_mode = state.current_mode
+    thresholds, modes = state.rules.transitions[previous_mode]
+    new_mode = modes[bisect_right(thresholds, rng.random())]
+    if new_mode == TENGOKU:
+        promo_rand = rng.random()
+        if promo_rand < TENGOKU_PROMOTION[0]: new_mode = SUPER_DOKI_DOKI
+        elif promo_rand < TENGOKU_PROMOTION[1]: new_mode = DOKI_DOKI
+    if new_mode != previous_mode:
+        state.current_mode = new_mode
+        if new_mode == DOKI_DOKI: state.doki_doki_entries += 1
+        elif new_mode == SUPER_DOKI_DOKI: state.super_doki_doki_entries += 1
+    if state.current_mode >= TENGOKU: state.bonus_through_count = 0
+    else: state.bonus_through_count += 1
+    return games
+
+def advance(state, tables, rng, budget):
+    if state.is_in_bonus_at:
+        return advance_bonus(state, tables, rng, budget)
+    return advance_gap(state, tables, rng, budget)
+
+def new_state(setting_level, rng):
+    state = GameState(setting_level=setting_level, is_reset=False)
+    rand = rng.random()
+    if rand < RESET_MODE_SPLIT[0]: state.current_mode = NORMAL_A
+    elif rand < RESET_MODE_SPLIT[1]: state.current_mode = NORMAL_B
+    else: state.current_mode = CHANCE
+    return state
+
+def run_simulation(total_spins, setting_level, seed=None):
+    rng = np.random.default_rng(seed)
+    state = new_state(setting_level, rng)
+    tables = GapTables(state.setting)
+    start_time = time.time()
+    next_report = 1000000
+    while state.total_games < total_spins:
+        advance(state, tables, rng, total_spins - state.total_games)
+        if state.total_games >= next_report:
+            print(f"  ... {state.total_games:,} games played ({time.time() - start_time:.2f}s)")
+            next_report += 1000000 * ((state.total_games - next_report) // 1000000 + 1)
+    print_report(setting_level, total_spins, collect_stats(state))
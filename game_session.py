@@ -0,0 +1,236 @@
+from array import array
+
+from rng import RandomStream
+from simulation_runner import (
+    BONUS_GAMES, KOYAKU, MEDALS_PER_SPIN, MODE_NAMES, NORMAL_A, TENGOKU, GameState, spin,
+)
+
+# --- ウェブUI用のゲームセッション ---
+# ブラウザの代わりに Python エンジンで台を進める。1ゲームごとの状態の差分から static/game.js の spin() と
+# 同じ形式のイベント (BONUS_START, 1G_REN, BONUS_END, RENCHAN_STREAK_END, KOYAKU_HIT など) を作り、
+# クレジットの推移は間引いた上で差分符号化して返す。ブラウザは結果を描画するだけでよい。
+# 連荘は game.js と同じ定義: 天国中 (1G連を含む) のボーナス当選で連荘数を増やし、天国から落ちた時点で終了。
+
+DEFAULT_CREDITS = 3000
+MAX_ADVANCE_GAMES = 10_000  # 1回のリクエストで進める上限 (AT中の1G連が続いても止まるように)
+DEFAULT_TRACE_POINTS = 500
+# スキップ中に返すイベント (小役の当選は1ゲームずつ進めるときだけ返す)
+SKIP_EVENTS = {"BONUS_START", "1G_REN", "BONUS_END", "RENCHAN_STREAK_END", "MODE_UPGRADE", "MIDDLE_CHERRY_HIT"}
+ADVANCE_TARGETS = ("spin", "bonus", "at_end")
+CHART_TILE_SIZE = 256  # 1タイルあたりのバケット数
+CHART_MIN_LEVEL = 1  # 2ゲームごとのバケット。1ゲームごとの値は保持しない
+CHART_MAX_LEVEL = 40
+
+class GameSession:
+    def __init__(self, setting_level, credits=DEFAULT_CREDITS, rng=None):
+        # セッションごとに独立した乱数ストリームを持つので、同時に進めても互いの結果に影響しない。
+        # rng を省略するとエントロピーから作る (サーバーはルートストリームから spawn() した子を渡す)
+        self.setting_level = setting_level
+        self.state = GameState(setting_level=setting_level, rng=rng if rng is not None else RandomStream())
+        self.credits = credits
+        self.current_bonus_type = None
+        self.renchan_count, self.renchan_payout = 0, 0
+        self.pyramid = CreditPyramid(credits)
+
+    def spin(self):
+        # 1ゲーム進めて、そのゲームのイベントのリストを返す
+        state = self.state
+        in_bonus, mode_before = state.is_in_bonus_at, state.current_mode
+        games_before = state.games_since_bonus
+        big_before, reg_before = state.bonus_count["BIG"], state.bonus_count["REG"]
+        koyaku_before = dict(state.koyaku_counts)
+        middle_cherry_before = state.middle_cherry_hits
+        self.credits -= MEDALS_PER_SPIN
+        payout = spin(state, verbose=False)
+        self.credits += payout
+        self.pyramid.append(self.credits)
+        if in_bonus and self.renchan_count > 0:
+            self.renchan_payout += payout
+
+        events, game = [], state.total_games
+        bonus_started = state.bonus_count["BIG"] != big_before or state.bonus_count["REG"] != reg_before
+        if in_bonus:
+            if bonus_started:
+                events.append(self._start_bonus("1G_REN", "BIG", 0, game))
+            elif not state.is_in_bonus_at:
+                event = {"event": "BONUS_END", "game": game, "mode_changed_to": MODE_NAMES[state.current_mode]}
+                if mode_before >= TENGOKU and state.current_mode < TENGOKU:
+                    event.update(self._end_renchan(), renchan_streak_ended=True)
+                events.append(event)
+            return events
+
+        if mode_before >= TENGOKU and state.current_mode == NORMAL_A and self.renchan_count > 0:
+            events.append({"event": "RENCHAN_STREAK_END", "game": game, "reason": "Tengoku抜け", **self._end_renchan()})
+        if state.middle_cherry_hits != middle_cherry_before:
+            events.append({"event": "MIDDLE_CHERRY_HIT", "game": game})
+        for name, count in state.koyaku_counts.items():
+            if count != koyaku_before.get(name, 0):
+                events.append({"event": "KOYAKU_HIT", "game": game, "name": name, "payout": KOYAKU.get(name, {}).get("payout", 0)})
+        if bonus_started:
+            bonus_type = "BIG" if state.bonus_count["BIG"] != big_before else "REG"
+            events.append(self._start_bonus("BONUS_START", bonus_type, games_before + 1, game))
+        elif state.current_mode != mode_before and state.current_mode > TENGOKU:
+            events.append({"event": "MODE_UPGRADE", "game": game, "to": MODE_NAMES[state.current_mode]})
+        return events
+
+    def _start_bonus(self, event, bonus_type, games_since_bonus, game):
+        if self.state.current_mode >= TENGOKU:
+            if self.renchan_count == 0:
+                self.renchan_payout = 0
+            self.renchan_count += 1
+        self.current_bonus_type = bonus_type
+        return {"event": event, "game": game, "type": bonus_type, "games": BONUS_GAMES[bonus_type], "games_since_bonus": games_since_bonus}
+
+    def _end_renchan(self):
+        ended = {"renchan_count": self.renchan_count, "renchan_payout": self.renchan_payout}
+        self.renchan_count, self.renchan_payout = 0, 0
+        return ended
+
+    def advance(self, until, trace_points=DEFAULT_TRACE_POINTS):
+        # until: "spin" (1ゲーム) / "bonus" (次のボーナス当選まで。AT中ならATを消化して次の当選まで) / "at_end" (ボーナスATの終了まで)
+        # trace_points が0ならクレジット推移 (trace) を作らず、レスポンスにも含めない (グラフをタイルから描く場合)
+        if until not in ADVANCE_TARGETS:
+            raise ValueError(f"until must be one of {', '.join(ADVANCE_TARGETS)}.")
+        state = self.state
+        if until == "at_end" and not state.is_in_bonus_at:
+            raise ValueError("Not in a bonus AT.")
+        start_game = state.total_games
+        games, credits, events = [start_game], [self.credits], []
+        while self.credits >= MEDALS_PER_SPIN and state.total_games - start_game < MAX_ADVANCE_GAMES:
+            spin_events = self.spin()
+            if trace_points:
+                games.append(state.total_games)
+                credits.append(self.credits)
+            if until == "spin":
+                events += spin_events
+                break
+            events += [event for event in spin_events if event["event"] in SKIP_EVENTS]
+            if until == "bonus" and any(event["event"] in ("BONUS_START", "1G_REN") for event in spin_events):
+                break
+            if until == "at_end" and not state.is_in_bonus_at:
+                break
+        result = {"games": state.total_games - start_game, "events": events, "state": self.snapshot()}
+        if trace_points:
+            result["trace"] = encode_trace(*downsample_trace(games, credits, trace_points))
+        return result
+
+    def snapshot(self):
+        state = self.state
+        return {
+            "setting": self.setting_level,
+            "credits": self.credits,
+            "out_of_credits": self.credits < MEDALS_PER_SPIN,
+            "total_games": state.total_games,
+            "games_since_bonus": state.games_since_bonus,
+            "current_mode": MODE_NAMES[state.current_mode],
+            "is_in_bonus_at": state.is_in_bonus_at,
+            "current_bonus_type": self.current_bonus_type,
+            "bonus_games_remaining": state.bonus_games_remaining,
+            "renchan_count": self.renchan_count,
+            "renchan_payout": self.renchan_payout,
+        }
+
+# --- クレジット推移の圧縮 ---
+
+class CreditPyramid:
+    # クレジット推移の多重解像度表現。点 j は j ゲーム目終了時のクレジット (点 0 は開始時)。
+    # レベル L のバケット i は点 [i * 2**L, (i + 1) * 2**L) の (最小, 最大, 最後) で、バケットが埋まるごとに
+    # 1つ上のレベルへ順に畳み込む (1点あたり償却 O(1))。
+    # 1点ごとの値 (レベル0) は CHART_MIN_LEVEL のバケットに畳み込むまでの分だけ持ち、畳み込んだら捨てるので、
+    # 保持するのは CHART_MIN_LEVEL 以上のバケットだけになる。タイルも CHART_MIN_LEVEL 以上のレベルだけ返す。
+    # どの範囲・どの拡大率でも、表示幅に合うレベルのバケットを一定数読むだけでグラフを描ける。
+    def __init__(self, initial):
+        self.count = 1  # 点の数
+        self.pending = [initial]  # CHART_MIN_LEVEL のバケットにまだ畳み込んでいない点
+        self.levels = []  # CHART_MIN_LEVEL 以上の埋まったバケット: (mins, maxs, lasts)
+
+    def __len__(self):
+        return self.count
+
+    def append(self, value):
+        self.count += 1
+        pending = self.pending
+        pending.append(value)
+        if len(pending) == 1 << CHART_MIN_LEVEL:
+            self._push(CHART_MIN_LEVEL, min(pending), max(pending), value)
+            pending.clear()
+
+    def _push(self, level, low, high, last):
+        depth = level - CHART_MIN_LEVEL
+        if len(self.levels) <= depth:
+            self.levels.append((array("d"), array("d"), array("d")))
+        mins, maxs, lasts = self.levels[depth]
+        mins.append(low)
+        maxs.append(high)
+        lasts.append(last)
+        if len(mins) % 2 == 0:
+            self._push(level + 1, min(mins[-2], low), max(maxs[-2], high), last)
+
+    def bucket_count(self, level):
+        return -(-self.count >> level)
+
+    def bucket(self, level, index):
+        # level は CHART_MIN_LEVEL 以上
+        depth = level - CHART_MIN_LEVEL
+        if depth < len(self.levels) and index < len(self.levels[depth][0]):
+            mins, maxs, lasts = self.levels[depth]
+            return mins[index], maxs[index], lasts[index]
+        # 末尾の埋まっていないバケットは、畳み込んでいない点か1つ下のレベルから組み立てる
+        if level == CHART_MIN_LEVEL:
+            pending = self.pending
+            return min(pending), max(pending), pending[-1]
+        low, high, last = self.bucket(level - 1, 2 * index)
+        if 2 * index + 1 < self.bucket_count(level - 1):
+            low2, high2, last = self.bucket(level - 1, 2 * index + 1)
+            low, high = min(low, low2), max(high, high2)
+        return low, high, last
+
+    def tile(self, level, index, size=CHART_TILE_SIZE):
+        # レベル level (CHART_MIN_LEVEL 以上) のバケット [index * size, (index + 1) * size) をまとめて返す。末尾のタイルは短くなる
+        if level < CHART_MIN_LEVEL:
+            raise ValueError(f"level must be at least {CHART_MIN_LEVEL}.")
+        first = index * size
+        mins, maxs, lasts = [], [], []
+        for i in range(first, min(first + size, self.bucket_count(level))):
+            low, high, last = self.bucket(level, i)
+            mins.append(low)
+            maxs.append(high)
+            lasts.append(last)
+        return {
+            "level": level, "tile": index, "bucket_games": 2 ** level, "first_bucket": first,
+            "total_games": self.count - 1, "complete": (first + size) << level <= self.count,
+            "min": mins, "max": maxs, "last": lasts,
+        }
+
+def downsample_trace(games, credits, max_points):
+    # 区間ごとに最小値と最大値の点を (順序を保って) 残す。山と谷が消えないので、等間隔の間引きよりグラフの形が崩れない。
+    # 最初と最後の点は必ず残す。
+    if len(games) <= max_points:
+        return games, credits
+    buckets = max(1, (max_points - 2) // 2)
+    size = (len(games) - 2) / buckets
+    keep = [0]
+    for b in range(buckets):
+        lo, hi = 1 + int(b * size), 1 + int((b + 1) * size)
+        if lo >= hi:
+            continue
+        low = min(range(lo, hi), key=credits.__getitem__)
+        high = max(range(lo, hi), key=credits.__getitem__)
+        keep += sorted({low, high})
+    keep.append(len(games) - 1)
+    return [games[i] for i in keep], [credits[i] for i in keep]
+
+def encode_trace(games, credits):
+    # 先頭は絶対値、以降は直前の点との差分
+    return {
+        "games": [games[0]] + [b - a for a, b in zip(games, games[1:])],
+        "credits": [credits[0]] + [b - a for a, b in zip(credits, credits[1:])],
+    }
+
+def decode_trace(trace):
+    games, credits, x, y = [], [], 0, 0
+    for dx, dy in zip(trace["games"], trace["credits"]):
+        x, y = x + dx, y + dy
+        games.append(x)
+        credits.append(y)
+    return games, credits
@@ -0,0 +1,213 @@
+import json
+import random
+import sys
+import time
+from collections import defaultdict
+
+from simulation_runner import DOKI_DOKI, MODE_NAMES, NORMAL_A, SUPER_DOKI_DOKI, TENGOKU, spin
+
+# --- 計測 (プロファイル) ---
+# build_spin(profile) は simulation_runner.spin を包んで計測する spin を返す。profile が None なら spin をそのまま返すので、
+# 計測しないときのループには分岐もフラグも増えない。エンジンの写しは持たず、1ゲームの間だけ state.rng を
+# RecordingStream に差し替えて引いた乱数を記録し、spin() の前後の状態の差分と乱数の本数から分岐を数える。
+# 差し替えたストリームは元のストリームの値をそのまま返すので、結果は計測なしと完全に一致する。
+# 記録する内容: 分岐ごとの通過回数、モード移行の回数、1ゲームあたりの乱数使用本数、sample_every ゲームごとの処理時間。
+# 処理時間には perf_counter_ns() 1回分と RecordingStream の呼び出し (乱数1本あたり) の時間が乗るので、build_spin() で
+# 一度だけ測った値 (timing_overhead_ns) を差し引く。差し引いた後も1ゲーム単位の計測で、計測のコードに挟まれて
+# キャッシュが冷えた状態の時間なので、ループで回したときの平均 (benchmark.py) より長めに出る。比較は同じマシンのプロファイル同士で。
+# 分岐の判定は spin() の抽選の順序に依存する (通常時: 中段チェリー, 確定役, 天国テーブル, ボーナス確率, 小役 / ボーナス種別。
+# ボーナス終了時: 1G連役, 1G連, モード移行, 昇格)。抽選の順序を変えたときはここも確認すること。
+
+# 2: bonus.1g_ren_stock は1G連のストックが新しく立ったゲームの数 (ストック中の重複当選は数えない)
+# 3: 処理時間から計測のオーバーヘッドを差し引く
+PROFILE_VERSION = 3
+OVERHEAD_ROUNDS = 2000
+
+class EngineProfile:
+    def __init__(self, sample_every=1024):
+        self.sample_every = sample_every
+        self.games = 0
+        self.branches = defaultdict(int)
+        self.transitions = defaultdict(int)
+        self.draws_per_game = defaultdict(int)
+        self.timing_ns = defaultdict(int)
+        self.timing_samples = defaultdict(int)
+        self.timing_overhead_ns = {}
+
+    def to_dict(self):
+        return {
+            "version": PROFILE_VERSION,
+            "games": self.games,
+            "sample_every": self.sample_every,
+            "branches": dict(sorted(self.branches.items())),
+            "transitions": dict(sorted(self.transitions.items())),
+            "draws_per_game": {str(k): v for k, v in sorted(self.draws_per_game.items())},
+            "timing_ns_per_game": {path: self.timing_ns[path] / self.timing_samples[path] for path in sorted(self.timing_samples)},
+            "timing_samples": dict(sorted(self.timing_samples.items())),
+            "timing_overhead_ns": self.timing_overhead_ns,
+        }
+
+    def save(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, indent=2, ensure_ascii=False)
+
+class RecordingStream:
+    # 計測中の1ゲームだけ state.rng と差し替える。元のストリームの値をそのまま返し、引いた値を values に残す
+    def __init__(self):
+        self.stream, self.values = None, []
+
+    def random(self):
+        value = self.stream.random()
+        self.values.append(value)
+        return value
+
+def count_bonus_game(profile, state, before, draws):
+    # ボーナスAT中のゲーム。戻り値は処理時間の経路名
+    branches = profile.branches
+    mode_before, queued_before, big_before = before[0], before[2], before[3]
+    one_g_ren = state.bonus_count.get("BIG", 0) != big_before  # ボーナス終了時に1G連で次の BIG が始まった
+    if (state.queued_1g_ren or one_g_ren) and not queued_before:
+        branches["bonus.1g_ren_stock"] += 1
+    if one_g_ren:
+        branches["post_bonus.1g_ren"] += 1
+        return "bonus_end"
+    if state.is_in_bonus_at:
+        return "bonus"
+    mode_after = state.current_mode
+    profile.transitions[f"{MODE_NAMES[mode_before]} -> {MODE_NAMES[mode_after]}"] += 1
+    # 乱数は 1G連役 (チェリー・スイカなら続けて1G連), モード移行, (移行先が天国なら) 昇格の順に引く
+    stock_draws = 2 if draws[0] < state.rules.one_g_ren_thresholds[1] else 1
+    if len(draws) > stock_draws + 1:
+        if mode_after == SUPER_DOKI_DOKI: branches["post_bonus.promotion_super_doki"] += 1
+        elif mode_after == DOKI_DOKI: branches["post_bonus.promotion_doki"] += 1
+    return "bonus_end"
+
+def count_normal_game(profile, state, before, draws):
+    # 通常時のゲーム。戻り値は処理時間の経路名
+    branches = profile.branches
+    mode_before, big_before, reg_before = before[0], before[3], before[4]
+    middle_cherry_before, doki_before, super_doki_before, koyaku_before = before[5:]
+    mode = state.current_mode
+    # 通常時にモードが通常Aに変わるのは天国の範囲を抜けたときだけ (ボーナス当選はモードを変えない)
+    if mode_before >= TENGOKU and mode == NORMAL_A:
+        branches["normal.tengoku_drop"] += 1
+    bonus_count, koyaku_counts = state.bonus_count, state.koyaku_counts
+    bonus_type = ("BIG" if bonus_count.get("BIG", 0) != big_before else
+                  "REG" if bonus_count.get("REG", 0) != reg_before else None)
+    if bonus_type is not None:
+        branches[f"normal.bonus_{bonus_type}"] += 1
+        if state.middle_cherry_hits != middle_cherry_before:
+            branches["normal.middle_cherry"] += 1
+        elif koyaku_counts.get("GUARANTEED", 0) != koyaku_before.get("GUARANTEED", 0):
+            branches["normal.guaranteed"] += 1
+        elif len(draws) == 1:
+            branches["normal.ceiling"] += 1  # 天井はボーナス種別の抽選だけ
+        elif len(draws) == 4 and mode >= TENGOKU:
+            branches["normal.tengoku_table"] += 1  # 中段チェリー, 確定役, 天国テーブル, ボーナス種別
+        else:
+            branches["normal.bonus_prob"] += 1
+        return "normal_hit"
+    for name, count in koyaku_counts.items():
+        if count != koyaku_before.get(name, 0):
+            branches[f"normal.small_role.{name}"] += 1
+            break
+    else:
+        branches["normal.no_role"] += 1
+    if state.super_doki_doki_entries != super_doki_before:
+        branches["normal.upgrade_super_doki"] += 1
+    elif state.doki_doki_entries != doki_before:
+        branches["normal.upgrade_doki"] += 1
+    return "normal_miss"
+
+def measure_overhead(rounds=OVERHEAD_ROUNDS):
+    # (perf_counter_ns() 1回, RecordingStream の乱数1本あたり) の時間 (ns)。ゲームの乱数ストリームは使わない
+    perf_counter_ns = time.perf_counter_ns
+    timer = sorted(perf_counter_ns() - perf_counter_ns() for _ in range(rounds))
+    timer_ns = -timer[rounds // 2]
+    stream = random.Random(0)
+    recorder = RecordingStream()
+    recorder.stream = stream
+    bare_ns, recorded_ns = [], []
+    for _ in range(5):
+        start = perf_counter_ns()
+        for _ in range(rounds):
+            stream.random()
+        bare_ns.append(perf_counter_ns() - start)
+        recorder.values.clear()
+        start = perf_counter_ns()
+        for _ in range(rounds):
+            recorder.random()
+        recorded_ns.append(perf_counter_ns() - start)
+    return timer_ns, max(0.0, (min(recorded_ns) - min(bare_ns)) / rounds)
+
+def build_spin(profile=None, spin_game=spin):
+    if profile is None:
+        return spin_game
+
+    draws_per_game, timing_ns, timing_samples = profile.draws_per_game, profile.timing_ns, profile.timing_samples
+    sample_every = profile.sample_every
+    perf_counter_ns = time.perf_counter_ns
+    recorder = RecordingStream()
+    timer_ns, draw_ns = measure_overhead()
+    profile.timing_overhead_ns = {"timer": timer_ns, "per_draw": draw_ns}
+
+    def profiled_spin(state, verbose=False):
+        in_bonus = state.is_in_bonus_at
+        bonus_count = state.bonus_count
+        before = (state.current_mode, state.games_since_bonus, state.queued_1g_ren,
+                  bonus_count.get("BIG", 0), bonus_count.get("REG", 0), state.middle_cherry_hits,
+                  state.doki_doki_entries, state.super_doki_doki_entries, None if in_bonus else dict(state.koyaku_counts))
+        recorder.stream = state.rng
+        recorder.values.clear()
+        state.rng = recorder
+        sampled = state.total_games % sample_every == 0
+        if sampled:
+            start = perf_counter_ns()
+        try:
+            payout = spin_game(state, verbose)
+        finally:
+            state.rng = recorder.stream
+        if sampled:
+            elapsed = perf_counter_ns() - start
+        profile.games += 1
+        draws = recorder.values
+        draws_per_game[len(draws)] += 1
+        path = (count_bonus_game if in_bonus else count_normal_game)(profile, state, before, draws)
+        if sampled:
+            timing_ns[path] += elapsed - timer_ns - draw_ns * len(draws)
+            timing_samples[path] += 1
+        return payout
+
+    return profiled_spin
+
+# --- プロファイルの比較 ---
+
+def load_profile(path):
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+def per_game(profile, section):
+    return {key: value / profile["games"] for key, value in profile[section].items()}
+
+def print_profile_diff(before, after):
+    for section, label in (("branches", "Branch hits / game"), ("transitions", "Transitions / game"), ("draws_per_game", "RNG draws per game")):
+        old, new = per_game(before, section), per_game(after, section)
+        print(f"\n--- {label} ---")
+        for key in sorted(set(old) | set(new)):
+            a, b = old.get(key, 0.0), new.get(key, 0.0)
+            change = f"{(b - a) / a:+.1%}" if a else "new"
+            print(f"{key:>40} {a:12.6f} {b:12.6f} {change:>8}")
+    print("\n--- Sampled time per game (ns, timing overhead subtracted; single games, compare on the same machine) ---")
+    if before.get("version") != after.get("version"):
+        print("  (profiles have different versions; version 2 and earlier include the timing overhead)")
+    old, new = before["timing_ns_per_game"], after["timing_ns_per_game"]
+    for key in sorted(set(old) | set(new)):
+        a, b = old.get(key, 0.0), new.get(key, 0.0)
+        change = f"{(b - a) / a:+.1%}" if a else "new"
+        print(f"{key:>40} {a:12.1f} {b:12.1f} {change:>8}")
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print("Usage: python3 instrumentation.py before.json after.json")
+        sys.exit(1)
+    print_profile_diff(load_profile(sys.argv[1]), load_profile(sys.argv[2]))
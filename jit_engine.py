@@ -0,0 +1,228 @@
+import time
+
+import numpy as np
+
+from rng import RandomStream
+from simulation_runner import (
+    BONUS_GAMES, BONUS_PAYOUT_PER_GAME, CHANCE, DOKI_DOKI, GAME_CEILING, MIDDLE_CHERRY_PROB, NORMAL_A, NORMAL_B,
+    RESET_MODE_SPLIT, SUPER_DOKI_DOKI, TENGOKU, TENGOKU_LIMIT, TENGOKU_PROMOTION, THROUGH_CEILING, compile_rules, print_report,
+)
+
+# --- JIT コンパイルした spin カーネル (Numba があるときだけ) ---
+# spin() / handle_post_bonus() の状態機械を、整数配列の状態と事前に展開した確率の配列だけを使う関数として書き、
+# Numba で型付きのネイティブコードにコンパイルする。1回の呼び出しで block ゲーム (数百万) をまとめて進めるので、
+# インタープリターのオーバーヘッドは呼び出し1回分だけになる。抽選の順序は spin() と同じだが、乱数生成器は
+# Numba 内蔵のものなので結果は一致せず、同等性は benchmark.py の統計的な検定で確認する。
+# Numba がインストールされていなければ、既存の Python エンジン (simulation_runner.spin) で実行する。
+# 払い出しは 0.5枚単位の整数 (ボーナス中の 7.5枚 = 15) で数える。
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+BACKEND = "numba" if numba is not None else "python"
+BLOCK_GAMES = 4_000_000
+PAYOUT_SCALE = 2  # 払い出しの単位 (1枚 = 2)
+BONUS_PAYOUT_UNITS = round(BONUS_PAYOUT_PER_GAME * PAYOUT_SCALE)
+BIG_GAMES, REG_GAMES = BONUS_GAMES["BIG"], BONUS_GAMES["REG"]
+
+# 状態配列の添字
+(S_TOTAL_GAMES, S_PAYOUT, S_GAMES_SINCE_BONUS, S_MODE, S_THROUGH, S_IN_BONUS, S_BONUS_REMAINING, S_QUEUED_1G_REN,
+ S_MIDDLE_CHERRY, S_DOKI_DOKI, S_SUPER_DOKI_DOKI, S_BIG, S_REG, S_GUARANTEED, S_KOYAKU) = range(15)
+
+def new_state(rules, mode):
+    state = np.zeros(S_KOYAKU + rules.small_roles, dtype=np.int64)
+    state[S_MODE] = mode
+    return state
+
+def build_tables(rules):
+    # CompiledRules -> カーネルに渡す配列のタプル
+    # 昇格抽選のない小役は upgrade_doki を -1 にする
+    upgrade_super = np.array([u[0] if u is not None else 0.0 for u in rules.upgrades])
+    upgrade_doki = np.array([u[1] if u is not None else -1.0 for u in rules.upgrades])
+    width = max(len(thresholds) for thresholds, _ in rules.transitions)
+    transition_thresholds = np.full((len(rules.transitions), width), np.inf)
+    transition_modes = np.zeros((len(rules.transitions), width), dtype=np.int64)
+    for mode, (thresholds, modes) in enumerate(rules.transitions):
+        transition_thresholds[mode, :len(thresholds)] = thresholds
+        transition_modes[mode, :len(modes)] = modes
+    # 昇格抽選の閾値も配列で渡す (グローバルの定数はコンパイル結果のキャッシュに焼き込まれるため)
+    scalars = np.array([rules.bonus_prob, rules.guaranteed_prob, *TENGOKU_PROMOTION])
+    return (np.array(rules.koyaku_thresholds), np.array([round(p * PAYOUT_SCALE) for p in rules.koyaku_payouts], dtype=np.int64),
+            upgrade_super, upgrade_doki, np.array(rules.one_g_ren_thresholds), np.array(rules.one_g_ren_probs),
+            np.array(rules.tengoku_table), np.array(rules.big_ratio), transition_thresholds, transition_modes, scalars)
+
+def run_block(state, games, koyaku_thresholds, koyaku_payouts, upgrade_super, upgrade_doki, one_g_ren_thresholds,
+              one_g_ren_probs, tengoku_table, big_ratio, transition_thresholds, transition_modes, scalars):
+    bonus_prob, guaranteed_prob, promotion_super_doki, promotion_doki = scalars[0], scalars[1], scalars[2], scalars[3]
+    small_roles = koyaku_thresholds.shape[0]
+    for _ in range(games):
+        state[S_TOTAL_GAMES] += 1
+
+        # --- ボーナスAT中 ---
+        if state[S_IN_BONUS]:
+            state[S_GAMES_SINCE_BONUS] = 0
+            state[S_BONUS_REMAINING] -= 1
+            state[S_PAYOUT] += BONUS_PAYOUT_UNITS
+            u = np.random.random()
+            role = 0
+            while role < 2 and u >= one_g_ren_thresholds[role]:
+                role += 1
+            if role < 2 and np.random.random() < one_g_ren_probs[role]:
+                state[S_QUEUED_1G_REN] = 1
+            if state[S_BONUS_REMAINING] <= 0:
+                # handle_post_bonus()
+                state[S_IN_BONUS] = 0
+                if state[S_QUEUED_1G_REN]:
+                    state[S_QUEUED_1G_REN] = 0
+                    state[S_BIG] += 1
+                    state[S_GAMES_SINCE_BONUS] = 0
+                    state[S_IN_BONUS] = 1
+                    state[S_BONUS_REMAINING] = BIG_GAMES
+                    continue
+                previous_mode = state[S_MODE]
+                u = np.random.random()
+                index = 0
+                while u >= transition_thresholds[previous_mode, index]:
+                    index += 1
+                new_mode = transition_modes[previous_mode, index]
+                if new_mode == TENGOKU:
+                    promo_rand = np.random.random()
+                    if promo_rand < promotion_super_doki: new_mode = SUPER_DOKI_DOKI
+                    elif promo_rand < promotion_doki: new_mode = DOKI_DOKI
+                if new_mode != previous_mode:
+                    state[S_MODE] = new_mode
+                    if new_mode == DOKI_DOKI: state[S_DOKI_DOKI] += 1
+                    elif new_mode == SUPER_DOKI_DOKI: state[S_SUPER_DOKI_DOKI] += 1
+                if new_mode >= TENGOKU: state[S_THROUGH] = 0
+                else: state[S_THROUGH] += 1
+            continue
+
+        # --- 通常時 ---
+        state[S_GAMES_SINCE_BONUS] += 1
+        played = state[S_GAMES_SINCE_BONUS]
+        mode = state[S_MODE]
+        if mode >= TENGOKU and played > TENGOKU_LIMIT:
+            mode = NORMAL_A
+            state[S_MODE] = NORMAL_A
+            state[S_THROUGH] = 1
+        if played >= GAME_CEILING or state[S_THROUGH] >= THROUGH_CEILING:
+            bonus_hit = True
+        elif np.random.random() < MIDDLE_CHERRY_PROB:
+            state[S_MIDDLE_CHERRY] += 1
+            state[S_PAYOUT] += 3 * PAYOUT_SCALE
+            bonus_hit = True
+        elif np.random.random() < guaranteed_prob:
+            state[S_GUARANTEED] += 1
+            bonus_hit = True
+        elif mode >= TENGOKU and played <= TENGOKU_LIMIT and np.random.random() < tengoku_table[played - 1]:
+            bonus_hit = True
+        elif np.random.random() < bonus_prob:
+            bonus_hit = True
+        else:
+            bonus_hit = False
+
+        if not bonus_hit:
+            u = np.random.random()
+            role = 0
+            while role < small_roles and u >= koyaku_thresholds[role]:
+                role += 1
+            if role < small_roles:
+                state[S_PAYOUT] += koyaku_payouts[role]
+                state[S_KOYAKU + role] += 1
+                if mode >= TENGOKU and upgrade_doki[role] >= 0.0:
+                    upgrade_rand = np.random.random()
+                    if upgrade_rand < upgrade_super[role]:
+                        state[S_MODE] = SUPER_DOKI_DOKI
+                        state[S_SUPER_DOKI_DOKI] += 1
+                    elif upgrade_rand < upgrade_doki[role]:
+                        state[S_MODE] = DOKI_DOKI
+                        state[S_DOKI_DOKI] += 1
+        else:
+            # start_bonus()
+            if np.random.random() < big_ratio[mode]:
+                state[S_BIG] += 1
+                state[S_BONUS_REMAINING] = BIG_GAMES
+            else:
+                state[S_REG] += 1
+                state[S_BONUS_REMAINING] = REG_GAMES
+            state[S_GAMES_SINCE_BONUS] = 0
+            state[S_IN_BONUS] = 1
+
+# rng.RandomStream の例外: Numba のカーネルは Python のストリームを呼べないので、ストリームから引いた整数で
+# Numba 内蔵の np.random (スレッドごとの状態) を初期化して使う
+def seed_kernel(seed):
+    np.random.seed(seed)
+
+if numba is not None:
+    run_block = numba.njit(cache=True)(run_block)
+    seed_kernel = numba.njit(cache=True)(seed_kernel)
+
+def initial_mode(rng):
+    # GameState(is_reset=True) と同じリセット時のモード抽選
+    rand = rng.random()
+    if rand < RESET_MODE_SPLIT[0]: return NORMAL_A
+    if rand < RESET_MODE_SPLIT[1]: return NORMAL_B
+    return CHANCE
+
+def collect_stats(state, rules):
+    koyaku_counts = {name: int(state[S_KOYAKU + i]) for i, name in enumerate(rules.koyaku_names) if state[S_KOYAKU + i]}
+    if state[S_GUARANTEED]:
+        koyaku_counts["GUARANTEED"] = int(state[S_GUARANTEED])
+    return {
+        "total_games": int(state[S_TOTAL_GAMES]),
+        "total_payout": int(state[S_PAYOUT]) / PAYOUT_SCALE,
+        "middle_cherry_hits": int(state[S_MIDDLE_CHERRY]),
+        "doki_doki_entries": int(state[S_DOKI_DOKI]),
+        "super_doki_doki_entries": int(state[S_SUPER_DOKI_DOKI]),
+        "bonus_count": {"BIG": int(state[S_BIG]), "REG": int(state[S_REG])},
+        "koyaku_counts": koyaku_counts,
+    }
+
+def verify_kernel(setting_level, games, seed):
+    # コンパイル前の run_block を、np.random.random を RandomStream に差し替えて Python のまま実行し、
+    # 同じシードの spin() と統計が完全に一致するかを返す (抽選の順序と分岐が spin() と同じことの確認)。
+    # コンパイルした run_block は Numba 内蔵の乱数を使うので、この確認はコンパイル前の関数でしか行えない
+    import types
+    import simulation_runner
+    kernel = getattr(run_block, "py_func", run_block)
+    stream = RandomStream(seed)
+    rules = compile_rules(setting_level)
+    tables = build_tables(rules)
+    state = new_state(rules, initial_mode(stream))
+    module_np = kernel.__globals__["np"]
+    kernel.__globals__["np"] = types.SimpleNamespace(random=types.SimpleNamespace(random=stream.random))
+    try:
+        kernel(state, games, *tables)
+    finally:
+        kernel.__globals__["np"] = module_np
+    reference = simulation_runner.GameState(setting_level=setting_level, rng=RandomStream(seed))
+    for _ in range(games):
+        simulation_runner.spin(reference, verbose=False)
+    return collect_stats(state, rules) == simulation_runner.collect_stats(reference)
+
+def simulate(total_spins, setting_level, seed=None, block=BLOCK_GAMES, progress=None):
+    # Numba がなければ simulation_runner の Python エンジンで実行する (戻り値の形式は同じ)
+    if numba is None:
+        import simulation_runner
+        return simulation_runner.simulate(total_spins, setting_level, seed)
+    rng = RandomStream(seed)
+    seed_kernel(rng.randrange(2**32))
+    rules = compile_rules(setting_level)
+    tables = build_tables(rules)
+    state = new_state(rules, initial_mode(rng))
+    for start in range(0, total_spins, block):
+        run_block(state, min(block, total_spins - start), *tables)
+        if progress is not None:
+            progress(state)
+    return collect_stats(state, rules)
+
+def run_simulation(total_spins, setting_level, seed=None):
+    if numba is None:
+        print("Numba is not installed; running the python engine instead.")
+    start_time = time.time()
+    def report(state):
+        print(f"  ... {state[S_TOTAL_GAMES]:,} games played ({time.time() - start_time:.2f}s)")
+    stats = simulate(total_spins, setting_level, seed, progress=report)
+    print_report(setting_level, total_spins, stats)
@@ -0,0 +1,241 @@
+import sys
+import time
+
+import numpy as np
+from scipy import sparse
+from scipy.sparse.linalg import spsolve
+
+from simulation_runner import (
+    BONUS_GAMES, BONUS_PAYOUT_PER_GAME, CHANCE, DOKI_DOKI, GAME_CEILING, KOYAKU, MEDALS_PER_SPIN,
+    MIDDLE_CHERRY_PROB, MODE_NAMES, MODE_NORMAL_A, MODE_TRANSITIONS, NORMAL_A, NORMAL_B, ONE_G_REN_PROB,
+    SETTINGS, SUPER_DOKI_DOKI, TENGOKU, TENGOKU_LIMIT, TENGOKU_PROB_TABLE, TENGOKU_PROMOTION, TENGOKU_UPGRADE_PROB,
+    THROUGH_CEILING,
+)
+
+# --- マルコフ連鎖による厳密な出率計算 (モンテカルロなし) ---
+# 状態はゲーム開始時点の (モード, ボーナス間ゲーム数, スルー回数) と、
+# ボーナスAT中の (モード, 残りゲーム数, 1G連ストック, スルー回数)。
+# 1ゲーム分の遷移を spin() / handle_post_bonus() と同じ順序で疎行列に組み立て、定常分布を解く。
+
+NORMAL_MODES, TENGOKU_MODES = (NORMAL_A, NORMAL_B, CHANCE), (TENGOKU, DOKI_DOKI, SUPER_DOKI_DOKI)
+SMALL_ROLES = [name for name in KOYAKU if name != "GUARANTEED"]
+THROUGH_STATES = THROUGH_CEILING + 1   # スルー回数は天井以上をまとめて1状態にする
+MAX_BONUS_GAMES = max(BONUS_GAMES.values())
+
+# 状態番号の割り当て
+NORMAL_STATES = len(NORMAL_MODES) * THROUGH_STATES * GAME_CEILING
+TENGOKU_STATES = len(TENGOKU_MODES) * (TENGOKU_LIMIT + 1)
+BONUS_STATES = len(MODE_NAMES) * THROUGH_STATES * MAX_BONUS_GAMES * 2
+TOTAL_STATES = NORMAL_STATES + TENGOKU_STATES + BONUS_STATES
+
+def normal_index(mode, through, games):
+    mode = np.asarray(mode)
+    # 天国中のスルー回数は常に0なので、天国系モードはゲーム数だけで区別する
+    tengoku_index = NORMAL_STATES + (mode - TENGOKU) * (TENGOKU_LIMIT + 1) + games
+    return np.where(mode >= TENGOKU, tengoku_index, (mode * THROUGH_STATES + through) * GAME_CEILING + games)
+
+def bonus_index(mode, through, remaining, queued):
+    return NORMAL_STATES + TENGOKU_STATES + ((mode * THROUGH_STATES + through) * MAX_BONUS_GAMES + remaining - 1) * 2 + queued
+
+def big_ratio(mode):
+    if mode in TENGOKU_MODES: return 0.9
+    if mode in (NORMAL_A, NORMAL_B): return 0.6
+    return 0.7
+
+def post_bonus_outcomes(mode, mode_transitions=MODE_TRANSITIONS, promotion=TENGOKU_PROMOTION):
+    # get_mode_transition() の移行先確率 (端数は最後の移行先) と天国突入時の昇格抽選
+    transitions = mode_transitions.get(MODE_NAMES[mode], {MODE_NORMAL_A: 1.0})
+    super_doki, doki = promotion
+    targets = list(transitions.items())
+    probs = [prob for _, prob in targets[:-1]]
+    probs.append(1 - sum(probs))
+    outcomes = {}
+    for (target, _), prob in zip(targets, probs):
+        target = MODE_NAMES.index(target)
+        if target == TENGOKU:
+            for promoted, promo_prob in ((SUPER_DOKI_DOKI, super_doki), (DOKI_DOKI, doki - super_doki), (TENGOKU, 1 - doki)):
+                outcomes[promoted] = outcomes.get(promoted, 0.0) + prob * promo_prob
+        else:
+            outcomes[target] = outcomes.get(target, 0.0) + prob
+    return outcomes
+
+class ChainBuilder:
+    # mode_transitions / promotion / tengoku_table を渡すと、simulation_runner の値の代わりに使う (calibration.py 用)
+    def __init__(self, setting, mode_transitions=None, promotion=None, tengoku_table=None):
+        self.mode_transitions = MODE_TRANSITIONS if mode_transitions is None else mode_transitions
+        self.promotion = TENGOKU_PROMOTION if promotion is None else promotion
+        self.tengoku_table = TENGOKU_PROB_TABLE if tengoku_table is None else list(tengoku_table)
+        if len(self.tengoku_table) != TENGOKU_LIMIT:
+            raise ValueError(f"tengoku_table must have {TENGOKU_LIMIT} entries.")
+        self.rows, self.cols, self.vals = [], [], []
+        self.rewards = {name: np.zeros(TOTAL_STATES) for name in
+                        ("payout", "BIG", "REG", "middle_cherry", "doki_doki", "super_doki_doki", *KOYAKU)}
+        self.cherry_prob = setting["cherry_prob"]
+        self.bonus_prob = setting["bonus_prob"]
+        self.koyaku_probs = np.array([self.cherry_prob if name == "CHERRY" else KOYAKU[name]["prob"] for name in SMALL_ROLES])
+        self.koyaku_payout = float(self.koyaku_probs @ [KOYAKU[name]["payout"] for name in SMALL_ROLES])
+        self.doki_upgrade, self.super_upgrade = 0.0, 0.0
+        for i, name in enumerate(SMALL_ROLES):
+            if name in TENGOKU_UPGRADE_PROB:
+                self.super_upgrade += self.koyaku_probs[i] * TENGOKU_UPGRADE_PROB[name]["SUPER_DOKI"]
+                self.doki_upgrade += self.koyaku_probs[i] * (TENGOKU_UPGRADE_PROB[name]["DOKI"] - TENGOKU_UPGRADE_PROB[name]["SUPER_DOKI"])
+        self.one_g_ren_prob = self.cherry_prob * ONE_G_REN_PROB["CHERRY"] + KOYAKU["WATERMELON"]["prob"] * ONE_G_REN_PROB["WATERMELON"]
+
+    def add(self, rows, cols, vals):
+        rows, cols, vals = np.broadcast_arrays(rows, cols, vals)
+        self.rows.append(rows.ravel())
+        self.cols.append(cols.ravel())
+        self.vals.append(vals.ravel())
+
+    def add_normal(self, mode, through):
+        max_games = TENGOKU_LIMIT if mode in TENGOKU_MODES else GAME_CEILING - 1
+        games = np.arange(max_games + 1)
+        rows = normal_index(mode, through, games)
+        played = games + 1
+
+        # 天国32G転落 (天国中に33G目を迎えると通常Aへ)
+        if mode in TENGOKU_MODES:
+            dropped = played > TENGOKU_LIMIT
+            play_mode = np.where(dropped, NORMAL_A, mode)
+            play_through = np.where(dropped, 1, through)
+        else:
+            play_mode = np.full(games.shape, mode)
+            play_through = np.full(games.shape, through)
+        tengoku = play_mode >= TENGOKU
+        forced = (played >= GAME_CEILING) | (play_through >= THROUGH_CEILING)
+
+        # 成立役による抽選 (中段チェリー → 確定役 → 天国テーブル → 通常確率)
+        table = np.array(self.tengoku_table + [0.0])[np.minimum(played, TENGOKU_LIMIT + 1) - 1]
+        tengoku_prob = np.where(tengoku & (played <= TENGOKU_LIMIT), table, 0.0)
+        middle_cherry = np.where(forced, 0.0, MIDDLE_CHERRY_PROB)
+        rest = np.where(forced, 0.0, 1 - MIDDLE_CHERRY_PROB)
+        guaranteed = rest * KOYAKU["GUARANTEED"]["prob"]
+        rest = rest * (1 - KOYAKU["GUARANTEED"]["prob"])
+        rest = rest * (1 - tengoku_prob)
+        miss = rest * (1 - self.bonus_prob)
+        hit = 1 - miss
+
+        self.rewards["payout"][rows] = 3 * middle_cherry + miss * self.koyaku_payout
+        self.rewards["middle_cherry"][rows] = middle_cherry
+        self.rewards["GUARANTEED"][rows] = guaranteed
+        for i, name in enumerate(SMALL_ROLES):
+            self.rewards[name][rows] = miss * self.koyaku_probs[i]
+
+        # ハズレ (小役のみ): 天国中はチェリー・スイカでモード昇格
+        to_super = np.where(tengoku, miss * self.super_upgrade, 0.0)
+        to_doki = np.where(tengoku, miss * self.doki_upgrade, 0.0)
+        self.rewards["super_doki_doki"][rows] = to_super
+        self.rewards["doki_doki"][rows] = to_doki
+        draw = ~forced
+        self.add(rows[draw], normal_index(play_mode[draw], play_through[draw], played[draw]), (miss - to_super - to_doki)[draw])
+        if mode in TENGOKU_MODES:
+            stay = draw & tengoku
+            self.add(rows[stay], normal_index(SUPER_DOKI_DOKI, 0, played[stay]), to_super[stay])
+            self.add(rows[stay], normal_index(DOKI_DOKI, 0, played[stay]), to_doki[stay])
+
+        # ボーナス当選
+        ratio = np.array([big_ratio(m) for m in play_mode])
+        self.rewards["BIG"][rows] = hit * ratio
+        self.rewards["REG"][rows] = hit * (1 - ratio)
+        self.add(rows, bonus_index(play_mode, play_through, BONUS_GAMES["BIG"], 0), hit * ratio)
+        self.add(rows, bonus_index(play_mode, play_through, BONUS_GAMES["REG"], 0), hit * (1 - ratio))
+
+    def add_bonus(self, mode, through):
+        remaining = np.arange(1, MAX_BONUS_GAMES + 1)
+        for queued in (0, 1):
+            rows = bonus_index(mode, through, remaining, queued)
+            self.rewards["payout"][rows] = BONUS_PAYOUT_PER_GAME
+            ren_prob = 1.0 if queued else self.one_g_ren_prob
+            # 残り2G以上: AT継続
+            cont_rows, cont_remaining = rows[1:], remaining[1:] - 1
+            self.add(cont_rows, bonus_index(mode, through, cont_remaining, 1), ren_prob)
+            if not queued:
+                self.add(cont_rows, bonus_index(mode, through, cont_remaining, 0), 1 - ren_prob)
+            # 最終ゲーム: 1G連ならBIG、それ以外はモード移行
+            last = rows[0]
+            self.add(last, bonus_index(mode, through, BONUS_GAMES["BIG"], 0), ren_prob)
+            self.rewards["BIG"][last] = ren_prob
+            for target, prob in post_bonus_outcomes(mode, self.mode_transitions, self.promotion).items():
+                prob *= 1 - ren_prob
+                if prob == 0:
+                    continue
+                if target != mode:
+                    if target == DOKI_DOKI: self.rewards["doki_doki"][last] += prob
+                    elif target == SUPER_DOKI_DOKI: self.rewards["super_doki_doki"][last] += prob
+                next_through = 0 if target in TENGOKU_MODES else min(through + 1, THROUGH_CEILING)
+                self.add(last, normal_index(target, next_through, 0), prob)
+
+    def build(self):
+        for through in range(THROUGH_STATES):
+            for mode in NORMAL_MODES:
+                self.add_normal(mode, through)
+            for mode in range(len(MODE_NAMES)):
+                self.add_bonus(mode, through)
+        for mode in TENGOKU_MODES:
+            self.add_normal(mode, 0)
+        rows, cols, vals = (np.concatenate(parts) for parts in (self.rows, self.cols, self.vals))
+        return sparse.csr_matrix((vals, (rows, cols)), shape=(TOTAL_STATES, TOTAL_STATES))
+
+def stationary_distribution(transition, anchor):
+    # πP = π を (Pᵀ - I)π = 0 として解く。1行は冗長なので anchor 状態の行を π[anchor] = 1 に置き換え、
+    # 最後に正規化する (全1の正規化行を入れるとLU分解のフィルインが大きくなるため)。
+    size = transition.shape[0]
+    system = (transition.T - sparse.identity(size, format="csr")).tocoo()
+    keep = system.row != anchor
+    system = sparse.csc_matrix((np.append(system.data[keep], 1.0),
+                                (np.append(system.row[keep], anchor), np.append(system.col[keep], anchor))),
+                               shape=(size, size))
+    rhs = np.zeros(size)
+    rhs[anchor] = 1.0
+    pi = spsolve(system, rhs)
+    return pi / pi.sum()
+
+def solve(setting_level, mode_transitions=None, promotion=None, tengoku_table=None):
+    builder = ChainBuilder(SETTINGS[setting_level], mode_transitions, promotion, tengoku_table)
+    transition = builder.build()
+    # 天国中のBIG開始状態は必ず再帰的なので、これを基準状態にする
+    pi = stationary_distribution(transition, int(bonus_index(TENGOKU, 0, BONUS_GAMES["BIG"], 0)))
+    rates = {name: float(pi @ reward) for name, reward in builder.rewards.items()}
+    # ボーナス間の開始状態 (ボーナス間ゲーム数0) の内訳: 通常、スルー天井、天国系
+    gap_start = {"normal": 0.0, "through_ceiling": 0.0, "tengoku": 0.0}
+    for mode in NORMAL_MODES:
+        for through in range(THROUGH_STATES):
+            gap_start["through_ceiling" if through >= THROUGH_CEILING else "normal"] += pi[normal_index(mode, through, 0)]
+    for mode in TENGOKU_MODES:
+        gap_start["tengoku"] += pi[normal_index(mode, 0, 0)]
+    total = sum(gap_start.values())
+    return {
+        "payout_rate": rates["payout"] / MEDALS_PER_SPIN,
+        "bonus_rate": {"BIG": rates["BIG"], "REG": rates["REG"]},
+        "middle_cherry_rate": rates["middle_cherry"],
+        "doki_doki_rate": rates["doki_doki"],
+        "super_doki_doki_rate": rates["super_doki_doki"],
+        "koyaku_rate": {name: rates[name] for name in KOYAKU},
+        "gap_start_share": {name: float(share / total) for name, share in gap_start.items()},
+    }
+
+def inverse(rate):
+    return 1 / rate if rate > 0 else 0
+
+def print_solution(setting_level, result, elapsed):
+    bonus_rate = result["bonus_rate"]["BIG"] + result["bonus_rate"]["REG"]
+    print(f"\n--- Setting {setting_level} Exact Solution ({elapsed:.2f}s) ---")
+    print(f"Payout Rate: {result['payout_rate']:.4%}")
+    print(f"Bonus: 1 / {inverse(bonus_rate):,.1f} (BIG 1 / {inverse(result['bonus_rate']['BIG']):,.1f}, REG 1 / {inverse(result['bonus_rate']['REG']):,.1f})")
+    print(f"Middle Cherry Hits: 1 / {inverse(result['middle_cherry_rate']):,.0f}")
+    print(f"Doki Doki Entry: 1 / {inverse(result['doki_doki_rate']):,.0f}")
+    print(f"Super Doki Doki Entry: 1 / {inverse(result['super_doki_doki_rate']):,.0f}")
+
+if __name__ == "__main__":
+    try:
+        settings = [int(arg) for arg in sys.argv[1:]] or sorted(SETTINGS.keys())
+        for setting in settings:
+            if setting not in SETTINGS:
+                raise ValueError(f"Setting level {setting} not found.")
+        for setting in settings:
+            start_time = time.time()
+            result = solve(setting)
+            print_solution(setting, result, time.time() - start_time)
+    except ValueError as e:
+        print(f"Error: Invalid arguments. {e}")
+        print("Usage: python3 markov_solver.py [setting ...]")
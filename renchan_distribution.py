@@ -0,0 +1,56 @@
+import argparse
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from rng import RandomStream
+from run_all_simulations import shard_streams, split_games
+from simulation_runner import SETTINGS, GameState, observed_spin
+from terminal_graph_simulator import RenchanStats, RenchanTracker, print_renchan_distribution
+
+# --- 連荘分布の並列集計 ---
+# terminal_graph_simulator と同じ連荘の定義 (天国突入から転落まで) で、シャードごとに RenchanStats を集計して
+# シャード順にマージする。ヒストグラムは固定ビンの整数カウントなので、マージ結果はワーカー数に関係なく同じ。
+
+def run_renchan_shard(setting_level, games, rng):
+    state = GameState(setting_level=setting_level, rng=rng)
+    renchan = RenchanTracker()
+    spin_game = observed_spin([renchan])
+    for _ in range(games):
+        spin_game(state, verbose=False)
+    return renchan.stats
+
+def run_renchan_distribution(total_spins, setting_level, shards, executor, master_seed):
+    start_time = time.time()
+    games = split_games(total_spins, shards)
+    streams = shard_streams(master_seed, setting_level, shards)
+    stats = RenchanStats()
+    for shard in executor.map(run_renchan_shard, [setting_level] * shards, games, streams):
+        stats.merge(shard)
+    print(f"  ... {total_spins:,} games played in {shards} shards ({time.time() - start_time:.2f}s)")
+    print(f"\n--- 設定 {setting_level} 連荘分布 ({total_spins:,} ゲーム) ---")
+    print(f"最大連荘数: {stats.lengths.max}連 / 最大連荘獲得枚数: {stats.payouts.max:,.0f}枚")
+    print_renchan_distribution(stats)
+    print("\n連荘中の獲得枚数:")
+    for low, high, count in stats.payouts.bins():
+        print(f"{f'{low:,.0f}-{high:,.0f}枚':>16} {count / stats.payouts.count:7.2%} {'#' * round(count / stats.payouts.count * 100)}")
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Collect the Tengoku chain (renchan) distribution in parallel.")
+    parser.add_argument("--games", type=int, default=100_000_000)
+    parser.add_argument("--setting", type=int, default=1)
+    parser.add_argument("--shards", type=int, default=64)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--seed", type=int, default=None)
+    return parser.parse_args(argv)
+
+if __name__ == "__main__":
+    args = parse_args(sys.argv[1:])
+    if args.setting not in SETTINGS:
+        print(f"Error: Setting level {args.setting} not found.")
+        sys.exit(1)
+    if args.seed is None:
+        args.seed = RandomStream().root_seed
+    print(f"Master seed: {args.seed} ({args.shards} shards)")
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        run_renchan_distribution(args.games, args.setting, args.shards, executor, args.seed)
@@ -0,0 +1,41 @@
+import hashlib
+import random
+import secrets
+
+# --- 乱数ストリーム ---
+# エンジンの乱数はグローバルの random モジュールではなく、台ごとの RandomStream (GameState.rng) から取る。
+# 台やシャードごとに独立したストリームを1つのシードから作れ、同じシードなら常に同じ結果になる。
+# - 整数のシードで作ったストリームは random.seed(seed) と同じ乱数列になる (既存のシード・チェックポイントと互換)。
+# - spawn(n) の子ストリームは (シード, spawn_key) の SHA-512 (512ビット) でメルセンヌ・ツイスターを初期化するので、
+#   子ストリーム同士は独立で、spawn_key ごとに再現できる。標準ライブラリだけで動く (サーバーも NumPy なしで使える)。
+#   並列実行のシャード (run_all_simulations.shard_streams) とサーバーのシード・セッションはすべて spawn() で作る。
+# - 例外は jit_engine の Numba カーネル: コンパイルしたコードからは Python のオブジェクトを呼べないので、
+#   ストリームから引いた整数で Numba 側の np.random を seed_kernel() で初期化して使う。
+# 抽選は stream.random (C 実装の Random.random) を直接呼ぶ。NumPy でブロックごとに生成してリストから返す方式も試したが、
+# 1本ごとの呼び出しは同じ C の関数呼び出しのままで、生成した値の float 化と補充の判定の分だけ遅くなった (1ゲームあたり15〜25%)。
+
+class RandomStream(random.Random):
+    def __init__(self, seed=None, spawn_key=()):
+        # seed を省略すると OS のエントロピーから128ビットのシードを作る (root_seed で再現できる)
+        if seed is None:
+            seed = secrets.randbits(128)
+        self.root_seed, self.spawn_key = seed, tuple(spawn_key)
+        self.children_spawned = 0
+        if self.spawn_key:
+            seed = int.from_bytes(hashlib.sha512(f"{seed}:{self.spawn_key}".encode("ascii")).digest(), "little")
+        super().__init__(seed)
+
+    def spawn(self, count):
+        # 独立した子ストリームを count 本作る。NumPy の SeedSequence.spawn と同じく、続けて呼ぶと次の番号の子を返す
+        # (spawn_key は親の spawn_key + 子の番号)。複数のスレッドから呼ぶときは呼び出し側でロックする
+        first = self.children_spawned
+        self.children_spawned += count
+        return [RandomStream(self.root_seed, self.spawn_key + (i,)) for i in range(first, first + count)]
+
+    def __reduce__(self):
+        # 別プロセスに渡しても root_seed / spawn_key と乱数列の位置を保つ (random.Random の既定はシードを引き継がない)
+        return (self.__class__, (self.root_seed, self.spawn_key), (self.getstate(), self.children_spawned))
+
+    def __setstate__(self, state):
+        mt_state, self.children_spawned = state
+        self.setstate(mt_state)
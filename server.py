@@ -2,30 +2,212 @@ import http.server
 import socketserver
 import os
 import sys
+import json
+import math
+import queue
+import secrets
+import threading
+import time
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import urlsplit, parse_qs
+
+from game_session import ADVANCE_TARGETS, CHART_MAX_LEVEL, CHART_MIN_LEVEL, DEFAULT_CREDITS, DEFAULT_TRACE_POINTS, GameSession
+from rng import RandomStream
+from simulation_runner import MEDALS_PER_SPIN, SETTINGS, ruleset_hash, simulate
 
 # --- Configuration ---
 PORT = 8000
 DIRECTORY = "static"
 DEFAULT_SETTING = 1
 SETTING_LEVEL = DEFAULT_SETTING
+# /api/simulate の設定
+API_DEFAULT_GAMES = 1_000_000
+API_MAX_GAMES = 50_000_000
+API_CACHE_SIZE = 256
+API_WORKERS = os.cpu_count() or 1
+# 進捗ストリームの送信間隔 (秒)
+STREAM_DEFAULT_INTERVAL = 0.5
+STREAM_MIN_INTERVAL = 0.1
+STREAM_MAX_INTERVAL = 60.0
+# /api/session の設定
+SESSION_IDLE_TIMEOUT = 30 * 60  # 秒
+SESSION_MAX = 1024
+SESSION_MAX_TRACE_POINTS = 5000
 
-# --- Parse Command-Line Arguments ---
-if len(sys.argv) > 1:
-    try:
-        level = int(sys.argv[1])
-        # Simple validation, assumes SETTINGS dict will be in JS from 1-6
-        if 1 <= level <= 6:
-            SETTING_LEVEL = level
-        else:
-            print(f"Warning: Setting level '{level}' is out of range (1-6). Defaulting to {DEFAULT_SETTING}.")
-    except ValueError:
-        print(f"Warning: Invalid setting level '{sys.argv[1]}'. Defaulting to {DEFAULT_SETTING}.")
+# --- 乱数ストリーム ---
+# サーバーのシードと乱数ストリームは、起動時に作るルートストリームから spawn() した子だけを使う。
+# /api/simulate のシード未指定時のシードは1本の子ストリームから引き、セッションはそれぞれ新しい子ストリームで台を動かす。
+
+server_streams = RandomStream()
+server_streams_lock = threading.Lock()
+
+def spawn_stream():
+    with server_streams_lock:
+        return server_streams.spawn(1)[0]
+
+api_seed_stream = spawn_stream()
+
+def new_api_seed():
+    with server_streams_lock:
+        return api_seed_stream.randrange(2**32)
+
+# --- Simulation API ---
+# 同じ (ルールのハッシュ, 設定, ゲーム数, シード) の結果は LRU キャッシュから返す。
+# キャッシュには Future を入れるので、実行中の同じリクエストは1回の計算を共有する。
+# 計算はプロセスプールで行い、静的ファイルの配信スレッドをブロックしない。
+
+class ResultCache:
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_submit(self, key, submit):
+        with self._lock:
+            future = self._entries.get(key)
+            if future is not None:
+                self._entries.move_to_end(key)
+                return future, True
+            future = submit()
+            self._entries[key] = future
+            if len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        # 失敗した結果はキャッシュに残さない
+        def discard_failed(f):
+            if f.cancelled() or f.exception() is not None:
+                self.discard(key, f)
+        future.add_done_callback(discard_failed)
+        return future, False
+
+    def discard(self, key, future):
+        with self._lock:
+            if self._entries.get(key) is future:
+                del self._entries[key]
+
+def simulate_with_progress(games, setting, seed, progress_queue, interval):
+    # ワーカープロセス側で実行される。進捗はマネージャーのキューを通してハンドラーに渡す
+    return simulate(games, setting, seed, progress=progress_queue.put, progress_interval=interval)
+
+executor = None
+manager = None
+result_cache = ResultCache(API_CACHE_SIZE)
+
+def parse_simulate_query(query):
+    params = parse_qs(query)
+    def get_int(name, default):
+        values = params.get(name)
+        return int(values[0]) if values else default
+    setting = get_int("setting", SETTING_LEVEL)
+    games = get_int("games", API_DEFAULT_GAMES)
+    seed = get_int("seed", None)
+    if setting not in SETTINGS:
+        raise ValueError(f"Setting level {setting} not found.")
+    if not 1 <= games <= API_MAX_GAMES:
+        raise ValueError(f"games must be between 1 and {API_MAX_GAMES:,}.")
+    # シード未指定なら生成して返す (結果を再現できるように)
+    if seed is None:
+        seed = new_api_seed()
+    return setting, games, seed
+
+def parse_stream_interval(query):
+    # 範囲外は [STREAM_MIN_INTERVAL, STREAM_MAX_INTERVAL] に丸める。"inf" や "nan" は Queue.get(timeout=) で使えないので拒否する
+    interval = float(parse_qs(query).get("interval", [STREAM_DEFAULT_INTERVAL])[0])
+    if not math.isfinite(interval):
+        raise ValueError("interval must be a finite number.")
+    return min(max(interval, STREAM_MIN_INTERVAL), STREAM_MAX_INTERVAL)
+
+def simulate_response(setting, games, seed, rules_hash, cached, stats):
+    return {
+        "setting": setting, "games": games, "seed": seed, "ruleset_hash": rules_hash, "cached": cached,
+        "payout_rate": stats["total_payout"] / (stats["total_games"] * MEDALS_PER_SPIN),
+        **stats,
+    }
+
+# --- Game Session API ---
+# ウェブUIの SKIP / ATスキップ をサーバー側の Python エンジンで進める。セッションはメモリ上に保持し、
+# 最後のアクセスから SESSION_IDLE_TIMEOUT 秒たったもの (と SESSION_MAX を超えた古いもの) は作成・取得のたびに捨てる。
+# 同じセッションへの同時リクエストはセッションごとのロックで順番に処理する。
+
+class SessionStore:
+    def __init__(self, idle_timeout, max_sessions):
+        self.idle_timeout = idle_timeout
+        self.max_sessions = max_sessions
+        self._sessions = OrderedDict()  # id -> (最終アクセス時刻, ロック, セッション)。古い順
+        self._lock = threading.Lock()
+
+    def create(self, session):
+        session_id = secrets.token_urlsafe(12)
+        with self._lock:
+            self._evict(time.monotonic())
+            self._sessions[session_id] = (time.monotonic(), threading.Lock(), session)
+            if len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+        return session_id
+
+    def get(self, session_id):
+        # (ロック, セッション) を返す。期限切れや存在しない場合は None
+        with self._lock:
+            now = time.monotonic()
+            self._evict(now)
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                return None
+            _, lock, session = entry
+            self._sessions[session_id] = (now, lock, session)
+            self._sessions.move_to_end(session_id)
+            return lock, session
+
+    def _evict(self, now):
+        while self._sessions:
+            last_access = next(iter(self._sessions.values()))[0]
+            if now - last_access < self.idle_timeout:
+                break
+            self._sessions.popitem(last=False)
+
+session_store = SessionStore(SESSION_IDLE_TIMEOUT, SESSION_MAX)
+
+def parse_session_query(query):
+    params = parse_qs(query)
+    setting = int(params.get("setting", [SETTING_LEVEL])[0])
+    credits = float(params.get("credits", [DEFAULT_CREDITS])[0])
+    if setting not in SETTINGS:
+        raise ValueError(f"Setting level {setting} not found.")
+    # float() は "nan" や "inf" も受け付けるので、有限の値だけを通す
+    if not math.isfinite(credits) or credits < 0:
+        raise ValueError("credits must be a finite, non-negative number.")
+    return setting, credits
+
+def parse_advance_query(query):
+    params = parse_qs(query)
+    session_id = params.get("id", [""])[0]
+    until = params.get("until", ["spin"])[0]
+    points = int(params.get("points", [DEFAULT_TRACE_POINTS])[0])
+    if until not in ADVANCE_TARGETS:
+        raise ValueError(f"until must be one of {', '.join(ADVANCE_TARGETS)}.")
+    # points=0 はクレジット推移を返さない (グラフをタイルから描くクライアント向け)
+    if points != 0 and not 2 <= points <= SESSION_MAX_TRACE_POINTS:
+        raise ValueError(f"points must be 0 or between 2 and {SESSION_MAX_TRACE_POINTS}.")
+    return session_id, until, points
+
+def parse_chart_query(query):
+    params = parse_qs(query)
+    session_id = params.get("id", [""])[0]
+    level = int(params.get("level", [CHART_MIN_LEVEL])[0])
+    tile = int(params.get("tile", [0])[0])
+    if not CHART_MIN_LEVEL <= level <= CHART_MAX_LEVEL:
+        raise ValueError(f"level must be between {CHART_MIN_LEVEL} and {CHART_MAX_LEVEL}.")
+    if tile < 0:
+        raise ValueError("tile must not be negative.")
+    return session_id, level, tile
 
 # --- Custom Handler ---
 class CustomHandler(http.server.SimpleHTTPRequestHandler):
     def do_GET(self):
+        url = urlsplit(self.path)
         # If the request is for /config.js, generate it dynamically
-        if self.path == '/config.js':
+        if url.path == '/config.js':
             try:
                 self.send_response(200)
                 self.send_header('Content-type', 'application/javascript')
@@ -36,27 +218,171 @@ class CustomHandler(http.server.SimpleHTTPRequestHandler):
             except Exception as e:
                 print(f"Error generating config.js: {e}")
                 self.send_error(500, "Internal Server Error")
+        elif url.path == '/api/simulate':
+            self.handle_simulate(url.query)
+        elif url.path == '/api/simulate/stream':
+            self.handle_simulate_stream(url.query)
+        elif url.path == '/api/session/chart':
+            self.handle_session_chart(url.query)
         else:
             # For all other requests, serve files from the 'static' directory
             super().do_GET()
 
+    def do_POST(self):
+        url = urlsplit(self.path)
+        if url.path == '/api/session/new':
+            self.handle_session_new(url.query)
+        elif url.path == '/api/session/advance':
+            self.handle_session_advance(url.query)
+        else:
+            self.send_json(404, {"error": "Not found"})
+
+    def handle_session_new(self, query):
+        try:
+            setting, credits = parse_session_query(query)
+        except ValueError as e:
+            self.send_json(400, {"error": str(e)})
+            return
+        session = GameSession(setting, credits, rng=spawn_stream())
+        session_id = session_store.create(session)
+        self.send_json(200, {"id": session_id, "state": session.snapshot()})
+
+    def handle_session_advance(self, query):
+        try:
+            session_id, until, points = parse_advance_query(query)
+        except ValueError as e:
+            self.send_json(400, {"error": str(e)})
+            return
+        entry = session_store.get(session_id)
+        if entry is None:
+            self.send_json(404, {"error": "Session not found or expired"})
+            return
+        lock, session = entry
+        try:
+            with lock:
+                result = session.advance(until, points)
+        except ValueError as e:
+            self.send_json(409, {"error": str(e), "state": session.snapshot()})
+            return
+        self.send_json(200, {"id": session_id, **result})
+
+    def handle_session_chart(self, query):
+        # クレジット推移のピラミッドのタイル (レベル level のバケット tile * CHART_TILE_SIZE から)
+        try:
+            session_id, level, tile = parse_chart_query(query)
+        except ValueError as e:
+            self.send_json(400, {"error": str(e)})
+            return
+        entry = session_store.get(session_id)
+        if entry is None:
+            self.send_json(404, {"error": "Session not found or expired"})
+            return
+        lock, session = entry
+        with lock:
+            payload = session.pyramid.tile(level, tile)
+        self.send_json(200, payload)
+
+    def handle_simulate(self, query):
+        try:
+            setting, games, seed = parse_simulate_query(query)
+        except ValueError as e:
+            self.send_json(400, {"error": str(e)})
+            return
+        rules_hash = ruleset_hash(setting)
+        future, cached = result_cache.get_or_submit((rules_hash, setting, games, seed),
+                                                    lambda: executor.submit(simulate, games, setting, seed))
+        try:
+            stats = future.result()
+        except Exception as e:
+            print(f"Error running simulation: {e}")
+            self.send_json(500, {"error": "Simulation failed"})
+            return
+        self.send_json(200, simulate_response(setting, games, seed, rules_hash, cached, stats))
+
+    def handle_simulate_stream(self, query):
+        # Server-Sent Events で進捗を送り、最後に /api/simulate と同じ結果を "done" イベントで送る
+        try:
+            setting, games, seed = parse_simulate_query(query)
+            interval = parse_stream_interval(query)
+        except ValueError as e:
+            self.send_json(400, {"error": str(e)})
+            return
+        rules_hash = ruleset_hash(setting)
+        progress_queue = manager.Queue()
+        future, cached = result_cache.get_or_submit(
+            (rules_hash, setting, games, seed),
+            lambda: executor.submit(simulate_with_progress, games, setting, seed, progress_queue, interval))
+
+        self.send_response(200)
+        self.send_header('Content-type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        try:
+            # キャッシュ済み、または同じ実行を別のリクエストが進めている場合は進捗なしで結果を待つ
+            while not future.done():
+                try:
+                    snapshot = progress_queue.get(timeout=interval)
+                except queue.Empty:
+                    continue
+                self.send_event("progress", snapshot)
+            try:
+                stats = future.result()
+            except Exception as e:
+                print(f"Error running simulation: {e}")
+                self.send_event("error", {"error": "Simulation failed"})
+                return
+            self.send_event("done", simulate_response(setting, games, seed, rules_hash, cached, stats))
+        except (BrokenPipeError, ConnectionResetError):
+            # クライアントが切断しても実行は続け、結果はキャッシュに残す
+            pass
+
+    def send_event(self, event, payload):
+        self.wfile.write(f"event: {event}\ndata: {json.dumps(payload)}\n\n".encode('utf-8'))
+        self.wfile.flush()
+
+    def send_json(self, status, payload):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
     def __init__(self, *args, **kwargs):
         # The directory argument is available in Python 3.7+
         # For older versions, you might need to os.chdir() into the directory first
         super().__init__(*args, directory=DIRECTORY, **kwargs)
 
 
-# --- Server Startup ---
-# Allow the port to be reused immediately after the server is stopped
-socketserver.TCPServer.allow_reuse_address = True
+if __name__ == "__main__":
+    # --- Parse Command-Line Arguments ---
+    if len(sys.argv) > 1:
+        try:
+            level = int(sys.argv[1])
+            # Simple validation, assumes SETTINGS dict will be in JS from 1-6
+            if 1 <= level <= 6:
+                SETTING_LEVEL = level
+            else:
+                print(f"Warning: Setting level '{level}' is out of range (1-6). Defaulting to {DEFAULT_SETTING}.")
+        except ValueError:
+            print(f"Warning: Invalid setting level '{sys.argv[1]}'. Defaulting to {DEFAULT_SETTING}.")
+
+    # --- Server Startup ---
+    # Allow the port to be reused immediately after the server is stopped
+    socketserver.ThreadingTCPServer.allow_reuse_address = True
+    # シミュレーション中も静的ファイルを配信できるよう、リクエストごとにスレッドで処理する
+    socketserver.ThreadingTCPServer.daemon_threads = True
 
-with socketserver.TCPServer(("", PORT), CustomHandler) as httpd:
     # Change directory to the script's location to ensure relative paths work
     os.chdir(os.path.dirname(os.path.abspath(__file__)))
-    print(f"Serving Oki Doki 2 UI with [Setting {SETTING_LEVEL}] at http://localhost:{PORT}")
-    print("Press Ctrl+C to stop the server.")
-    try:
-        httpd.serve_forever()
-    except KeyboardInterrupt:
-        print("\nStopping server...")
-        httpd.server_close()
\ No newline at end of file
+    with multiprocessing.Manager() as manager, \
+         ProcessPoolExecutor(max_workers=API_WORKERS) as executor, \
+         socketserver.ThreadingTCPServer(("", PORT), CustomHandler) as httpd:
+        print(f"Serving Oki Doki 2 UI with [Setting {SETTING_LEVEL}] at http://localhost:{PORT}")
+        print("Press Ctrl+C to stop the server.")
+        try:
+            httpd.serve_forever()
+        except KeyboardInterrupt:
+            print("\nStopping server...")
+            httpd.server_close()
+            executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,130 @@
+import argparse
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from rng import RandomStream
+from run_all_simulations import shard_streams, split_games
+from simulation_runner import MEDALS_PER_SPIN, SETTINGS, GameState, observed_spin
+from sketches import Histogram, QuantileSketch
+from terminal_graph_simulator import RenchanTracker
+
+# --- セッション分布モード ---
+# 実戦1日分 (デフォルト8,000ゲーム) のセッションを独立に多数実行し、最終差枚数・最大ドローダウン・最大連荘数の
+# 分布を集計する。セッションごとの値はその場でスケッチとヒストグラムに入れるだけなので、メモリはセッション数に依存しない。
+# シャードごとの集計は merge() でまとめるため、並列ワーカー数に関係なく同じ結果になる。
+# 連荘: terminal_graph_simulator の RenchanTracker (天国に上がってから転落するまで) と同じ定義で数える。
+# セッション終了時に続いている連荘も、その時点の連荘数で最大値に含める。
+
+QUANTILES = (0.01, 0.05, 0.10, 0.25, 0.50, 0.75, 0.90, 0.95, 0.99)
+
+class SessionSummary:
+    def __init__(self):
+        self.sessions, self.profitable = 0, 0
+        self.final_medals = QuantileSketch()
+        self.max_drawdown = QuantileSketch()
+        self.final_medals_histogram = Histogram(-10000, 20000, 1000)
+        self.max_renchan_histogram = Histogram(0, 50, 1)
+
+    def add(self, final_medals, max_drawdown, max_renchan):
+        self.sessions += 1
+        if final_medals > 0: self.profitable += 1
+        self.final_medals.add(final_medals)
+        self.max_drawdown.add(max_drawdown)
+        self.final_medals_histogram.add(final_medals)
+        self.max_renchan_histogram.add(max_renchan)
+
+    def merge(self, other):
+        self.sessions += other.sessions
+        self.profitable += other.profitable
+        self.final_medals.merge(other.final_medals)
+        self.max_drawdown.merge(other.max_drawdown)
+        self.final_medals_histogram.merge(other.final_medals_histogram)
+        self.max_renchan_histogram.merge(other.max_renchan_histogram)
+        return self
+
+def run_session(setting_level, games, rng):
+    # 戻り値は (最終差枚数, 最大ドローダウン, 最大連荘数)
+    state = GameState(setting_level=setting_level, rng=rng)
+    renchan = RenchanTracker()
+    spin_game = observed_spin([renchan])
+    credits = peak = max_drawdown = 0.0
+    for _ in range(games):
+        spin_game(state, verbose=False)
+        credits = state.total_payout - state.total_games * MEDALS_PER_SPIN
+        if credits > peak:
+            peak = credits
+        elif peak - credits > max_drawdown:
+            max_drawdown = peak - credits
+    renchan.end()
+    return credits, max_drawdown, renchan.max_count
+
+def run_sessions(setting_level, sessions, games, rng):
+    # シャード内のセッションはシャードのストリームを順に使う
+    summary = SessionSummary()
+    for _ in range(sessions):
+        summary.add(*run_session(setting_level, games, rng))
+    return summary
+
+def run_session_distribution(setting_level, sessions, games, shards, executor, master_seed):
+    start_time = time.time()
+    counts = split_games(sessions, shards)
+    streams = shard_streams(master_seed, setting_level, shards)
+    summary = SessionSummary()
+    for shard in executor.map(run_sessions, [setting_level] * shards, counts, [games] * shards, streams):
+        summary.merge(shard)
+    print(f"  ... {sessions:,} sessions played in {shards} shards ({time.time() - start_time:.2f}s)")
+    print_session_report(setting_level, games, summary)
+
+def print_session_report(setting_level, games, summary):
+    print(f"\n--- Setting {setting_level} Session Distribution ({summary.sessions:,} sessions x {games:,} games) ---")
+    print(f"Profit Probability: {summary.profitable / summary.sessions:.2%}")
+    print(f"{'Quantile':>8} {'Final Medals':>13} {'Max Drawdown':>13}")
+    for q in QUANTILES:
+        print(f"{q:>8.0%} {summary.final_medals.quantile(q):>+13,.0f} {summary.max_drawdown.quantile(q):>13,.0f}")
+
+    print("\nFinal Medals:")
+    histogram = summary.final_medals_histogram
+    rows = [(f"< {histogram.low:+,}", histogram.underflow)]
+    rows += [(f"{low:+,} .. {high:+,}", count) for low, high, count in histogram.bins()]
+    rows.append((f">= {histogram.high:+,}", histogram.overflow))
+    print_histogram_rows(rows, summary.sessions)
+
+    print("\nMax Renchan:")
+    histogram = summary.max_renchan_histogram
+    rows = [(f"{low}", count) for low, _, count in histogram.bins()] + [(f">= {histogram.high}", histogram.overflow)]
+    print_histogram_rows(rows, summary.sessions)
+
+def print_histogram_rows(rows, total):
+    # 両端の0件の行は省く
+    counts = [count for _, count in rows]
+    first = next((i for i, count in enumerate(counts) if count), 0)
+    last = len(counts) - next((i for i, count in enumerate(reversed(counts)) if count), 0)
+    for label, count in rows[first:last]:
+        print(f"{label:>18} {count / total:7.2%} {'#' * round(count / total * 100)}")
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Simulate the distribution of outcomes over independent sessions.")
+    parser.add_argument("--setting", type=int, default=1)
+    parser.add_argument("--sessions", type=int, default=10_000)
+    parser.add_argument("--games", type=int, default=8000, help="games per session")
+    parser.add_argument("--shards", type=int, default=64)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args(argv)
+    for name in ("sessions", "games", "shards", "workers"):
+        value = getattr(args, name)
+        if value is not None and value < 1:
+            parser.error(f"--{name} must be at least 1")
+    return args
+
+if __name__ == "__main__":
+    args = parse_args(sys.argv[1:])
+    if args.setting not in SETTINGS:
+        print(f"Error: Setting level {args.setting} not found.")
+        sys.exit(1)
+    if args.seed is None:
+        args.seed = RandomStream().root_seed
+    print(f"Master seed: {args.seed} ({args.shards} shards)")
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        run_session_distribution(args.setting, args.sessions, args.games, min(args.shards, args.sessions), executor, args.seed)
@@ -0,0 +1,82 @@
+import argparse
+import sys
+import time
+
+import numpy as np
+
+import markov_solver
+from fast_forward import GapTables
+from simulation_runner import GAME_CEILING, SETTINGS
+
+# --- 設定推測 (ベイズ推定) ---
+# 実戦データ (総ゲーム数、チェリー回数、BIG/REG回数、ボーナス間ゲーム数) から各設定の事後確率を求める。
+# 尤度表は厳密解ソルバーの定常分布から設定ごとに1回だけ作る:
+#   チェリー回数        ~ 二項分布 (1ゲームあたりのチェリー成立率)
+#   BIG回数 | ボーナス回数 ~ 二項分布 (全ボーナスに占めるBIGの割合、1G連を含む)
+#   ボーナス間ゲーム数    ~ 通常・スルー天井・天国開始の混合分布 (fast_forward.GapTables と同じハザード)
+# ボーナス間ゲーム数は互いに独立とみなす近似 (合成尤度) で、指定したときはボーナス回数の二項分布の代わりに使う。
+# 採点はすべて NumPy 配列で行うので、多数のセッションをまとめて処理できる。
+
+class SettingEstimator:
+    def __init__(self, levels=None, prior=None):
+        self.levels = sorted(SETTINGS) if levels is None else list(levels)
+        self.log_prior = np.log(np.full(len(self.levels), 1 / len(self.levels)) if prior is None else np.asarray(prior, dtype=float))
+        solutions = [markov_solver.solve(level) for level in self.levels]
+        cherry_rate = np.array([s["koyaku_rate"]["CHERRY"] for s in solutions])
+        bonus_rate = np.array([s["bonus_rate"]["BIG"] + s["bonus_rate"]["REG"] for s in solutions])
+        big_share = np.array([s["bonus_rate"]["BIG"] for s in solutions]) / bonus_rate
+        self.cherry_log = np.log(cherry_rate), np.log1p(-cherry_rate)
+        self.bonus_log = np.log(bonus_rate), np.log1p(-bonus_rate)
+        self.big_log = np.log(big_share), np.log1p(-big_share)
+
+        # ボーナス間ゲーム数の対数確率表 (列 = ゲーム数 0..GAME_CEILING)。0G (1G連) は設定を区別しないので0にする
+        self.interval_log_pmf = np.zeros((len(self.levels), GAME_CEILING + 1))
+        for row, (level, solution) in enumerate(zip(self.levels, solutions)):
+            tables, share = GapTables(SETTINGS[level]), solution["gap_start_share"]
+            pmf = share["normal"] * np.diff(tables.cdf[False], prepend=0.0) + share["tengoku"] * np.diff(tables.cdf[True], prepend=0.0)
+            pmf[0] += share["through_ceiling"]
+            self.interval_log_pmf[row, 1:] = np.log(np.maximum(pmf, 1e-300))
+
+    def log_likelihood(self, games, cherry, big, reg, intervals=None, interval_session=None):
+        # games/cherry/big/reg はセッションごとの配列。intervals はボーナス間ゲーム数を全セッション分つなげた配列で、
+        # interval_session は各要素のセッション番号。戻り値は (セッション数, 設定数) の対数尤度
+        games, cherry, big, reg = (np.asarray(x, dtype=float)[:, None] for x in (games, cherry, big, reg))
+        result = cherry * self.cherry_log[0] + (games - cherry) * self.cherry_log[1]
+        result += big * self.big_log[0] + reg * self.big_log[1]
+        if intervals is None:
+            bonuses = big + reg
+            result += bonuses * self.bonus_log[0] + (games - bonuses) * self.bonus_log[1]
+            return result
+        intervals = np.clip(np.asarray(intervals, dtype=np.int64), 0, GAME_CEILING)
+        interval_session = np.asarray(interval_session, dtype=np.int64)
+        for row in range(len(self.levels)):
+            result[:, row] += np.bincount(interval_session, weights=self.interval_log_pmf[row, intervals], minlength=len(result))
+        return result
+
+    def posterior(self, games, cherry, big, reg, intervals=None, interval_session=None):
+        log_post = self.log_likelihood(games, cherry, big, reg, intervals, interval_session) + self.log_prior
+        log_post -= log_post.max(axis=1, keepdims=True)
+        post = np.exp(log_post)
+        return post / post.sum(axis=1, keepdims=True)
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Estimate the setting from observed session data.")
+    parser.add_argument("--games", type=int, required=True)
+    parser.add_argument("--cherry", type=int, required=True)
+    parser.add_argument("--big", type=int, required=True)
+    parser.add_argument("--reg", type=int, required=True)
+    parser.add_argument("--intervals", default=None, help="comma-separated games between bonuses")
+    return parser.parse_args(argv)
+
+if __name__ == "__main__":
+    args = parse_args(sys.argv[1:])
+    start_time = time.time()
+    estimator = SettingEstimator()
+    intervals = interval_session = None
+    if args.intervals:
+        intervals = [int(x) for x in args.intervals.split(",") if x.strip()]
+        interval_session = [0] * len(intervals)
+    post = estimator.posterior([args.games], [args.cherry], [args.big], [args.reg], intervals, interval_session)[0]
+    print(f"\n--- Setting Estimate ({args.games:,} games, {time.time() - start_time:.2f}s) ---")
+    for level, prob in zip(estimator.levels, post):
+        print(f"Setting {level}: {prob:6.1%} {'#' * int(round(prob * 40))}")
@@ -1,7 +1,15 @@
-import random
+import argparse
+import hashlib
+import json
+import os
+import struct
 import time
 import sys
+from bisect import bisect_right
 from collections import defaultdict
+from types import MappingProxyType
+
+from rng import RandomStream
 
 # --- ゲーム定数 (Version 2.3) ---
 
@@ -46,35 +54,97 @@ MODE_TRANSITIONS = {
     MODE_DOKI_DOKI:{MODE_DOKI_DOKI: 0.78, MODE_SUPER_DOKI_DOKI: 0.20, MODE_NORMAL_A: 0.01, MODE_NORMAL_B: 0.01},
     MODE_SUPER_DOKI_DOKI: {MODE_SUPER_DOKI_DOKI: 0.94, MODE_NORMAL_A: 0.06},
 }
+# ボーナス後に天国へ移行したときの昇格抽選の閾値 (超ドキドキ, ドキドキ)
+TENGOKU_PROMOTION = (0.005, 0.08)
+# リセット時のモード抽選の閾値 (通常A, 通常B。残りはチャンス)
+RESET_MODE_SPLIT = (0.50, 0.602)
+
+# --- コンパイル済みルール ---
+# モードを整数コードで扱い、累積確率の閾値を設定ごとに1回だけ前計算する。
+# 抽選は bisect で行うが、閾値は元の累積ループと同じ順序で加算しているので、同じシードなら結果は完全に一致する。
+
+MODE_NAMES = [MODE_NORMAL_A, MODE_NORMAL_B, MODE_CHANCE, MODE_TENGOKU, MODE_DOKI_DOKI, MODE_SUPER_DOKI_DOKI]
+NORMAL_A, NORMAL_B, CHANCE, TENGOKU, DOKI_DOKI, SUPER_DOKI_DOKI = range(len(MODE_NAMES))
+TENGOKU_LIMIT = len(TENGOKU_PROB_TABLE)
+
+def cumulative_thresholds(probs):
+    thresholds, cumulative_prob = [], 0
+    for prob in probs:
+        cumulative_prob += prob
+        thresholds.append(cumulative_prob)
+    return thresholds
+
+def compile_transitions(transitions):
+    # 端数で累積確率が1に届かない場合は最後の移行先を選ぶので、最後の閾値は inf にする
+    thresholds = cumulative_thresholds(transitions.values())
+    thresholds[-1] = float("inf")
+    return tuple(thresholds), tuple(MODE_NAMES.index(mode) for mode in transitions)
+
+class CompiledRules:
+    # 生成後は変更不可。グローバルの KOYAKU などは書き換えないので、異なる設定の台を同じプロセスで同時に動かせる。
+    __slots__ = ("_frozen", "setting", "bonus_prob", "guaranteed_prob", "koyaku_names", "koyaku_thresholds", "koyaku_payouts", "small_roles",
+                 "upgrades", "one_g_ren_thresholds", "one_g_ren_probs", "tengoku_table", "big_ratio", "transitions",
+                 "middle_cherry_transitions")
+
+    def __init__(self, setting):
+        self.setting = MappingProxyType(dict(setting))
+        self.bonus_prob = setting["bonus_prob"]
+        self.guaranteed_prob = KOYAKU["GUARANTEED"]["prob"]
+        probs = {name: setting["cherry_prob"] if name == "CHERRY" else data["prob"] for name, data in KOYAKU.items()}
+        self.koyaku_names = tuple(name for name in KOYAKU if name != "GUARANTEED")
+        self.koyaku_thresholds = tuple(cumulative_thresholds(probs[name] for name in self.koyaku_names))
+        self.koyaku_payouts = tuple(KOYAKU[name]["payout"] for name in self.koyaku_names)
+        self.small_roles = len(self.koyaku_names)
+        self.upgrades = tuple((TENGOKU_UPGRADE_PROB[name]["SUPER_DOKI"], TENGOKU_UPGRADE_PROB[name]["DOKI"])
+                              if name in TENGOKU_UPGRADE_PROB else None for name in self.koyaku_names)
+        self.one_g_ren_thresholds = tuple(cumulative_thresholds(probs[name] for name in ("CHERRY", "WATERMELON")))
+        self.one_g_ren_probs = (ONE_G_REN_PROB["CHERRY"], ONE_G_REN_PROB["WATERMELON"])
+        self.tengoku_table = tuple(TENGOKU_PROB_TABLE)
+        self.big_ratio = (0.6, 0.6, 0.7, 0.9, 0.9, 0.9)
+        self.transitions = tuple(compile_transitions(MODE_TRANSITIONS.get(mode, {MODE_NORMAL_A: 1.0})) for mode in MODE_NAMES)
+        self.middle_cherry_transitions = ((0.55, 0.95, float("inf")), (SUPER_DOKI_DOKI, DOKI_DOKI, TENGOKU))
+        self._frozen = True
+
+    def __setattr__(self, name, value):
+        if getattr(self, "_frozen", False):
+            raise AttributeError(f"CompiledRules is immutable (cannot set '{name}')")
+        object.__setattr__(self, name, value)
+
+_compiled_rules = {}
+
+def compile_rules(setting_level):
+    if setting_level not in _compiled_rules:
+        _compiled_rules[setting_level] = CompiledRules(SETTINGS[setting_level])
+    return _compiled_rules[setting_level]
 
 class GameState:
-    def __init__(self, setting_level=1, is_reset=True):
-        self.setting = SETTINGS[setting_level]
-        KOYAKU["CHERRY"]["prob"] = self.setting["cherry_prob"]
+    __slots__ = ("setting", "rules", "total_games", "total_payout", "games_since_bonus", "bonus_count", "koyaku_counts",
+                 "middle_cherry_hits", "bonus_through_count", "doki_doki_entries", "super_doki_doki_entries",
+                 "is_in_bonus_at", "bonus_games_remaining", "queued_1g_ren", "middle_cherry_pending", "current_mode", "rng")
+
+    def __init__(self, setting_level=1, is_reset=True, rules=None, rng=None):
+        # rng はこの台の乱数ストリーム (rng.RandomStream)。省略すると OS のエントロピーから作る
+        self.rng = rng if rng is not None else RandomStream()
+        self.rules = rules if rules is not None else compile_rules(setting_level)
+        self.setting = self.rules.setting
         self.total_games, self.total_payout, self.games_since_bonus = 0, 0, 0
         self.bonus_count, self.koyaku_counts, self.middle_cherry_hits = defaultdict(int), defaultdict(int), 0
         self.bonus_through_count, self.doki_doki_entries, self.super_doki_doki_entries = 0, 0, 0
         self.is_in_bonus_at, self.bonus_games_remaining, self.queued_1g_ren, self.middle_cherry_pending = False, 0, False, False
         if is_reset:
-            rand = random.random()
-            if rand < 0.50: self.current_mode = MODE_NORMAL_A
-            elif rand < 0.602: self.current_mode = MODE_NORMAL_B
-            else: self.current_mode = MODE_CHANCE
-        else: self.current_mode = MODE_NORMAL_A
-    def is_tengoku(self): return self.current_mode in [MODE_TENGOKU, MODE_DOKI_DOKI, MODE_SUPER_DOKI_DOKI]
-
-def get_mode_transition(current_mode, source="NORMAL"):
+            rand = self.rng.random()
+            if rand < RESET_MODE_SPLIT[0]: self.current_mode = NORMAL_A
+            elif rand < RESET_MODE_SPLIT[1]: self.current_mode = NORMAL_B
+            else: self.current_mode = CHANCE
+        else: self.current_mode = NORMAL_A
+    def is_tengoku(self): return self.current_mode >= TENGOKU
+
+def get_mode_transition(state, current_mode, source="NORMAL"):
     if source == "MIDDLE_CHERRY":
-        rand = random.random()
-        if rand < 0.55: return MODE_SUPER_DOKI_DOKI
-        elif rand < 0.95: return MODE_DOKI_DOKI
-        else: return MODE_TENGOKU
-    transitions = MODE_TRANSITIONS.get(current_mode, {MODE_NORMAL_A: 1.0})
-    rand, cumulative_prob = random.random(), 0
-    for mode, prob in transitions.items():
-        cumulative_prob += prob
-        if rand < cumulative_prob: return mode
-    return list(transitions.keys())[-1]
+        thresholds, modes = state.rules.middle_cherry_transitions
+    else:
+        thresholds, modes = state.rules.transitions[current_mode]
+    return modes[bisect_right(thresholds, state.rng.random())]
 
 def start_bonus(state, bonus_type, verbose=True):
     state.bonus_count[bonus_type] += 1
@@ -89,22 +159,23 @@ def handle_post_bonus(state, bonus_source="NORMAL", verbose=True):
         start_bonus(state, "BIG", verbose)
         return
     previous_mode = state.current_mode
-    new_mode = get_mode_transition(previous_mode, bonus_source)
-    if new_mode == MODE_TENGOKU and bonus_source != "MIDDLE_CHERRY":
-        promo_rand = random.random()
-        if promo_rand < 0.005: new_mode = MODE_SUPER_DOKI_DOKI
-        elif promo_rand < 0.08: new_mode = MODE_DOKI_DOKI
+    new_mode = get_mode_transition(state, previous_mode, bonus_source)
+    if new_mode == TENGOKU and bonus_source != "MIDDLE_CHERRY":
+        promo_rand = state.rng.random()
+        if promo_rand < TENGOKU_PROMOTION[0]: new_mode = SUPER_DOKI_DOKI
+        elif promo_rand < TENGOKU_PROMOTION[1]: new_mode = DOKI_DOKI
     if new_mode != previous_mode:
         state.current_mode = new_mode
-        if new_mode == MODE_DOKI_DOKI: state.doki_doki_entries += 1
-        elif new_mode == MODE_SUPER_DOKI_DOKI: state.super_doki_doki_entries += 1
-    if state.is_tengoku(): state.bonus_through_count = 0
+        if new_mode == DOKI_DOKI: state.doki_doki_entries += 1
+        elif new_mode == SUPER_DOKI_DOKI: state.super_doki_doki_entries += 1
+    if new_mode >= TENGOKU: state.bonus_through_count = 0
     else: state.bonus_through_count += 1
 
 def spin(state, verbose=True):
+    rand = state.rng.random
+    rules = state.rules
     state.total_games += 1
     payout = 0
-    bonus_source = "NORMAL"
 
     # --- 1. Bonus AT State ---
     if state.is_in_bonus_at:
@@ -113,115 +184,373 @@ def spin(state, verbose=True):
         payout += BONUS_PAYOUT_PER_GAME
 
         # 1G連抽選
-        rand, cumulative_prob = random.random(), 0
-        for name in ["CHERRY", "WATERMELON"]:
-            cumulative_prob += KOYAKU[name]["prob"]
-            if rand < cumulative_prob:
-                if random.random() < ONE_G_REN_PROB[name]:
-                    state.queued_1g_ren = True
-                break
-        
+        role = bisect_right(rules.one_g_ren_thresholds, rand())
+        if role < 2 and rand() < rules.one_g_ren_probs[role]:
+            state.queued_1g_ren = True
+
         # ボーナス終了判定
         if state.bonus_games_remaining <= 0:
             handle_post_bonus(state, verbose=verbose)
 
     # --- 2. Normal State ---
     else:
-        state.games_since_bonus += 1
+        games = state.games_since_bonus = state.games_since_bonus + 1
+        mode = state.current_mode
         bonus_hit = False
 
         # 天井判定
-        if state.is_tengoku() and state.games_since_bonus > 32:
-            state.current_mode = MODE_NORMAL_A
+        if mode >= TENGOKU and games > TENGOKU_LIMIT:
+            mode = state.current_mode = NORMAL_A
             state.bonus_through_count = 1
-        if state.games_since_bonus >= GAME_CEILING or state.bonus_through_count >= THROUGH_CEILING:
+        if games >= GAME_CEILING or state.bonus_through_count >= THROUGH_CEILING:
             bonus_hit = True
-        
+
         # 成立役による抽選
-        if not bonus_hit:
-            # 中段チェリー
-            if random.random() < MIDDLE_CHERRY_PROB:
-                state.middle_cherry_hits += 1
-                payout += 3 # チェリーとしての払い出し
-                bonus_hit = True
-                bonus_source = "MIDDLE_CHERRY"
-            # 確定役
-            elif random.random() < KOYAKU["GUARANTEED"]["prob"]:
-                state.koyaku_counts["GUARANTEED"] += 1
-                bonus_hit = True
-            # 天国中
-            elif state.is_tengoku() and state.games_since_bonus <= 32 and random.random() < TENGOKU_PROB_TABLE[state.games_since_bonus - 1]:
-                bonus_hit = True
-            # 通常時のボーナス確率
-            else:
-                prob = state.setting["bonus_prob"]
-                # モード別確率補正 (仮)
-                if random.random() < prob:
-                    bonus_hit = True
-        
+        # 中段チェリー
+        elif rand() < MIDDLE_CHERRY_PROB:
+            state.middle_cherry_hits += 1
+            payout += 3 # チェリーとしての払い出し
+            bonus_hit = True
+        # 確定役
+        elif rand() < rules.guaranteed_prob:
+            state.koyaku_counts["GUARANTEED"] += 1
+            bonus_hit = True
+        # 天国中
+        elif mode >= TENGOKU and games <= TENGOKU_LIMIT and rand() < rules.tengoku_table[games - 1]:
+            bonus_hit = True
+        # 通常時のボーナス確率
+        elif rand() < rules.bonus_prob:
+            bonus_hit = True
+
         # 小役の払い出し
         if not bonus_hit:
-            rand, cumulative_prob = random.random(), 0
-            for name, data in KOYAKU.items():
-                if name == "GUARANTEED": continue
-                cumulative_prob += data["prob"]
-                if rand < cumulative_prob:
-                    payout += data["payout"]
-                    state.koyaku_counts[name] += 1
-                    # 天国中のモード昇格抽選
-                    if state.is_tengoku() and name in TENGOKU_UPGRADE_PROB:
-                        upgrade_rand = random.random()
-                        if upgrade_rand < TENGOKU_UPGRADE_PROB[name]["SUPER_DOKI"]:
-                            state.current_mode = MODE_SUPER_DOKI_DOKI
-                            state.super_doki_doki_entries += 1
-                        elif upgrade_rand < TENGOKU_UPGRADE_PROB[name]["DOKI"]:
-                            state.current_mode = MODE_DOKI_DOKI
-                            state.doki_doki_entries += 1
-                    break
-        
+            role = bisect_right(rules.koyaku_thresholds, rand())
+            if role < rules.small_roles:
+                payout += rules.koyaku_payouts[role]
+                state.koyaku_counts[rules.koyaku_names[role]] += 1
+                # 天国中のモード昇格抽選
+                upgrade = rules.upgrades[role]
+                if mode >= TENGOKU and upgrade is not None:
+                    upgrade_rand = rand()
+                    if upgrade_rand < upgrade[0]:
+                        state.current_mode = SUPER_DOKI_DOKI
+                        state.super_doki_doki_entries += 1
+                    elif upgrade_rand < upgrade[1]:
+                        state.current_mode = DOKI_DOKI
+                        state.doki_doki_entries += 1
+
         # ボーナス当選時の処理
-        if bonus_hit:
-            if state.is_tengoku():
-                big_ratio = 0.9
-            elif state.current_mode in [MODE_NORMAL_A, MODE_NORMAL_B]:
-                big_ratio = 0.6
-            else:
-                big_ratio = 0.7
-            
-            bonus_type = "BIG" if random.random() < big_ratio else "REG"
+        else:
+            bonus_type = "BIG" if rand() < rules.big_ratio[mode] else "REG"
             start_bonus(state, bonus_type, verbose)
             # ここでボーナスゲームの1G目を消化しないように、これ以上の処理は行わない
-    
+
     state.total_payout += payout
     return payout
 
-def run_simulation(total_spins, setting_level):
-    state = GameState(setting_level=setting_level)
+# --- オブザーバー ---
+# 連荘の記録、クレジット履歴、イベントログなどの追加の集計は spin() に書き込まず、spin() の前後の状態の差分から
+# 呼ばれるフックで行う。オブザーバーは次のメソッドのうち必要なものだけを持つオブジェクト:
+#   on_game(state, payout)              毎ゲーム
+#   on_mode_change(state, previous_mode)  モードが変わったゲーム (天国抜け、小役による昇格、ボーナス後の移行)
+#   on_bonus_end(state, mode_before)    ボーナスATが終わったゲーム (1G連で次のボーナスに続く場合は呼ばない)
+#   on_bonus_start(state, bonus_type, games_since_bonus, one_g_ren, middle_cherry)  ボーナス当選 (1G連を含む。1G連の games_since_bonus は0)
+# 同じゲームのフックは上の順に呼ぶ。observed_spin() は購読されたフックに必要な差分だけを取る spin を組み立て、
+# フックが1つもなければ spin をそのまま返すので、何も購読しない実行のループは変わらない。
+# フックは乱数を使わないこと (購読の有無で結果が変わらないように)。
+
+OBSERVER_HOOKS = ("on_game", "on_mode_change", "on_bonus_end", "on_bonus_start")
+
+def observed_spin(observers, spin_game=spin):
+    game_hooks, mode_hooks, end_hooks, start_hooks = (
+        [getattr(observer, name) for observer in observers if hasattr(observer, name)] for name in OBSERVER_HOOKS)
+    if not (mode_hooks or end_hooks or start_hooks):
+        if not game_hooks:
+            return spin_game
+
+        # on_game だけなら状態の差分は取らない
+        def spin_and_notify_games(state, verbose=False):
+            payout = spin_game(state, verbose)
+            for hook in game_hooks:
+                hook(state, payout)
+            return payout
+
+        return spin_and_notify_games
+
+    def spin_and_notify(state, verbose=False):
+        in_bonus, mode_before = state.is_in_bonus_at, state.current_mode
+        games_before, middle_cherry_before = state.games_since_bonus, state.middle_cherry_hits
+        bonus_count = state.bonus_count
+        big_before, reg_before = bonus_count["BIG"], bonus_count["REG"]
+        payout = spin_game(state, verbose)
+        for hook in game_hooks:
+            hook(state, payout)
+        if state.current_mode != mode_before:
+            for hook in mode_hooks:
+                hook(state, mode_before)
+        if in_bonus and not state.is_in_bonus_at:
+            for hook in end_hooks:
+                hook(state, mode_before)
+        elif bonus_count["BIG"] != big_before or bonus_count["REG"] != reg_before:
+            bonus_type = "BIG" if bonus_count["BIG"] != big_before else "REG"
+            middle_cherry = state.middle_cherry_hits != middle_cherry_before
+            for hook in start_hooks:
+                hook(state, bonus_type, 0 if in_bonus else games_before + 1, in_bonus, middle_cherry)
+        return payout
+
+    return spin_and_notify
+
+def collect_stats(state):
+    return {
+        "total_games": state.total_games,
+        "total_payout": state.total_payout,
+        "middle_cherry_hits": state.middle_cherry_hits,
+        "doki_doki_entries": state.doki_doki_entries,
+        "super_doki_doki_entries": state.super_doki_doki_entries,
+        "bonus_count": dict(state.bonus_count),
+        "koyaku_counts": dict(state.koyaku_counts),
+    }
+
+def print_report(setting_level, total_spins, stats):
+    total_games = stats["total_games"]
+    print(f"\n--- Setting {setting_level} Simulation Complete ({total_spins:,} games) ---")
+    print(f"Calculated Payout Rate: {stats['total_payout'] / (total_games * MEDALS_PER_SPIN):.2%}")
+    doki_prob = total_games / stats["doki_doki_entries"] if stats["doki_doki_entries"] > 0 else 0
+    super_doki_prob = total_games / stats["super_doki_doki_entries"] if stats["super_doki_doki_entries"] > 0 else 0
+    print(f"Middle Cherry Hits: {stats['middle_cherry_hits']:,} (1 / {total_games / stats['middle_cherry_hits'] if stats['middle_cherry_hits'] > 0 else 0:,.0f})")
+    print(f"Doki Doki Entry: {stats['doki_doki_entries']:,} times (1 / {doki_prob:,.0f})")
+    print(f"Super Doki Doki Entry: {stats['super_doki_doki_entries']:,} times (1 / {super_doki_prob:,.0f})")
+
+# --- チェックポイント ---
+# 長時間の実行を途中から再開するため、GameState の全フィールドと台の乱数ストリーム (state.rng) の状態を固定長のバイナリで保存する。
+# 再開後は中断しなかった場合と完全に同じ結果になる。
+
+CHECKPOINT_MAGIC, CHECKPOINT_VERSION = b"OKDKCKPT", 1
+CHECKPOINT_FIELDS = ("total_games", "games_since_bonus", "middle_cherry_hits", "bonus_through_count",
+                     "doki_doki_entries", "super_doki_doki_entries", "bonus_games_remaining", "current_mode",
+                     "is_in_bonus_at", "queued_1g_ren", "middle_cherry_pending")
+CHECKPOINT_HEADER = struct.Struct("<8sH32sqq")
+CHECKPOINT_STATE = struct.Struct("<d" + "q" * (len(CHECKPOINT_FIELDS) + len(BONUS_GAMES) + len(KOYAKU)))
+CHECKPOINT_RNG = struct.Struct("<q625I?d")
+
+RULESET_CONSTANTS = ("MEDALS_PER_SPIN", "BONUS_PAYOUT_PER_GAME", "BONUS_GAMES", "MIDDLE_CHERRY_PROB", "KOYAKU", "ONE_G_REN_PROB",
+                     "TENGOKU_UPGRADE_PROB", "TENGOKU_PROB_TABLE", "MODE_TRANSITIONS", "TENGOKU_PROMOTION", "RESET_MODE_SPLIT",
+                     "GAME_CEILING", "THROUGH_CEILING")
+
+def ruleset_hash(setting_level=None):
+    # ルール定数のハッシュ。setting_level を指定するとその設定の値だけを含める
+    constants = globals()
+    rules = {name: constants[name] for name in RULESET_CONSTANTS}
+    rules["SETTINGS"] = constants["SETTINGS"] if setting_level is None else constants["SETTINGS"][setting_level]
+    return hashlib.sha256(json.dumps(rules, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+def save_checkpoint(path, state, setting_level, total_spins):
+    version, internal_state, gauss_next = state.rng.getstate()
+    counts = [state.bonus_count[name] for name in BONUS_GAMES] + [state.koyaku_counts[name] for name in KOYAKU]
+    data = b"".join((
+        CHECKPOINT_HEADER.pack(CHECKPOINT_MAGIC, CHECKPOINT_VERSION, bytes.fromhex(ruleset_hash(setting_level)), setting_level, total_spins),
+        CHECKPOINT_STATE.pack(state.total_payout, *(int(getattr(state, name)) for name in CHECKPOINT_FIELDS), *counts),
+        CHECKPOINT_RNG.pack(version, *internal_state, gauss_next is not None, gauss_next or 0.0),
+    ))
+    # 書き込み途中で中断されても前回のチェックポイントが壊れないよう、一時ファイルから置き換える
+    temp_path = path + ".tmp"
+    with open(temp_path, "wb") as f:
+        f.write(data)
+    os.replace(temp_path, path)
+
+def load_checkpoint(path):
+    with open(path, "rb") as f:
+        data = f.read()
+    magic, version, rules_digest, setting_level, total_spins = CHECKPOINT_HEADER.unpack_from(data, 0)
+    if magic != CHECKPOINT_MAGIC or version != CHECKPOINT_VERSION:
+        raise ValueError(f"{path} is not a compatible checkpoint file.")
+    if setting_level not in SETTINGS or rules_digest.hex() != ruleset_hash(setting_level):
+        raise ValueError(f"{path} was written with different game rules.")
+    values = CHECKPOINT_STATE.unpack_from(data, CHECKPOINT_HEADER.size)
+    state = GameState(setting_level=setting_level, is_reset=False)
+    state.total_payout = values[0]
+    for name, value in zip(CHECKPOINT_FIELDS, values[1:]):
+        setattr(state, name, bool(value) if name in ("is_in_bonus_at", "queued_1g_ren", "middle_cherry_pending") else value)
+    counts = values[1 + len(CHECKPOINT_FIELDS):]
+    for name, value in zip(BONUS_GAMES, counts):
+        if value: state.bonus_count[name] = value
+    for name, value in zip(KOYAKU, counts[len(BONUS_GAMES):]):
+        if value: state.koyaku_counts[name] = value
+    rng = CHECKPOINT_RNG.unpack_from(data, CHECKPOINT_HEADER.size + CHECKPOINT_STATE.size)
+    state.rng.setstate((rng[0], tuple(rng[1:626]), rng[627] if rng[626] else None))
+    return state, setting_level, total_spins
+
+# 進捗コールバックを確認する間隔 (ゲーム数)。この単位の内側のループには余計な処理を入れない
+PROGRESS_CHUNK = 16384
+
+def progress_snapshot(state):
+    return {
+        "total_games": state.total_games,
+        "payout_rate": state.total_payout / (state.total_games * MEDALS_PER_SPIN) if state.total_games else 0.0,
+        "doki_doki_entries": state.doki_doki_entries,
+        "super_doki_doki_entries": state.super_doki_doki_entries,
+        "bonus_count": dict(state.bonus_count),
+    }
+
+def simulate(total_spins, setting_level, seed=None, progress=None, progress_interval=0.5):
+    # 出力なしで実行して統計だけを返す (server.py のワーカーから呼ばれる)
+    # progress を指定すると、progress_interval 秒ごとに progress_snapshot() を渡して呼ぶ
+    state = GameState(setting_level=setting_level, rng=RandomStream(seed))
+    if progress is None:
+        for _ in range(total_spins):
+            spin(state, verbose=False)
+        return collect_stats(state)
+    next_report = time.monotonic() + progress_interval
+    for start in range(0, total_spins, PROGRESS_CHUNK):
+        for _ in range(min(PROGRESS_CHUNK, total_spins - start)):
+            spin(state, verbose=False)
+        if time.monotonic() >= next_report:
+            progress(progress_snapshot(state))
+            next_report = time.monotonic() + progress_interval
+    return collect_stats(state)
+
+def run_simulation(total_spins, setting_level, state=None, checkpoint_path=None, checkpoint_every=10_000_000, profile=None,
+                   observers=(), seed=None):
+    if state is None:
+        state = GameState(setting_level=setting_level, rng=RandomStream(seed))
+    if profile is None:
+        spin_game = spin
+    else:
+        # 計測付きの spin は計測するときだけ組み立てる (計測なしのループは変わらない)
+        from instrumentation import build_spin
+        spin_game = build_spin(profile)
+    spin_game = observed_spin(observers, spin_game)
     start_time = time.time()
-    for i in range(total_spins):
+    for i in range(state.total_games, total_spins):
         if (i + 1) % 1000000 == 0:
              print(f"  ... {i+1:,} games played ({time.time() - start_time:.2f}s)")
-        spin(state, verbose=False)
-    
-    print(f"\n--- Setting {setting_level} Simulation Complete ({total_spins:,} games) ---")
-    print(f"Calculated Payout Rate: {state.total_payout / (state.total_games * MEDALS_PER_SPIN):.2%}")
-    doki_prob = state.total_games / state.doki_doki_entries if state.doki_doki_entries > 0 else 0
-    super_doki_prob = state.total_games / state.super_doki_doki_entries if state.super_doki_doki_entries > 0 else 0
-    print(f"Middle Cherry Hits: {state.middle_cherry_hits:,} (1 / {state.total_games / state.middle_cherry_hits if state.middle_cherry_hits > 0 else 0:,.0f})")
-    print(f"Doki Doki Entry: {state.doki_doki_entries:,} times (1 / {doki_prob:,.0f})")
-    print(f"Super Doki Doki Entry: {state.super_doki_doki_entries:,} times (1 / {super_doki_prob:,.0f})")
+             if checkpoint_path and (i + 1) % checkpoint_every == 0:
+                 save_checkpoint(checkpoint_path, state, setting_level, total_spins)
+        spin_game(state, verbose=False)
+    if checkpoint_path:
+        save_checkpoint(checkpoint_path, state, setting_level, total_spins)
+    print_report(setting_level, total_spins, collect_stats(state))
+
+# --- 目標精度までの適応実行 (バッチ平均法) ---
+# ボーナスの連荘でゲーム間の相関が強いため、1ゲーム単位の分散では信頼区間を過小評価する。
+# 一定ゲーム数のバッチごとの出率を独立な標本とみなし、その分散から信頼区間を求める。
+# バッチ数が上限に達したら隣り合う2つを統合してバッチ幅を2倍にするので、バッチは相関時間に比べて十分長くなっていく。
+
+CI_Z = 1.96  # 95% 信頼区間
+BATCH_MEANS_MIN, BATCH_MEANS_MAX = 32, 64
+
+def batch_means_half_width(batch_payouts, batch_games):
+    rates = [payout / (batch_games * MEDALS_PER_SPIN) for payout in batch_payouts]
+    mean = sum(rates) / len(rates)
+    variance = sum((rate - mean) ** 2 for rate in rates) / (len(rates) - 1)
+    return CI_Z * (variance / len(rates)) ** 0.5
+
+def run_adaptive_simulation(target_ci, setting_level, max_spins, batch_games=100_000, seed=None):
+    state = GameState(setting_level=setting_level, rng=RandomStream(seed))
+    batch_payouts, half_width = [], float("inf")
+    start_time = time.time()
+    while state.total_games + batch_games <= max_spins:
+        payout_before = state.total_payout
+        for _ in range(batch_games):
+            spin(state, verbose=False)
+        batch_payouts.append(state.total_payout - payout_before)
+        if len(batch_payouts) == BATCH_MEANS_MAX:
+            batch_payouts = [a + b for a, b in zip(batch_payouts[0::2], batch_payouts[1::2])]
+            batch_games *= 2
+        if len(batch_payouts) < BATCH_MEANS_MIN:
+            continue
+        half_width = batch_means_half_width(batch_payouts, batch_games)
+        if state.total_games % 1000000 == 0:
+             print(f"  ... {state.total_games:,} games played, 95% CI ±{half_width:.3%} ({time.time() - start_time:.2f}s)")
+        if half_width <= target_ci:
+            break
+    stats = collect_stats(state)
+    print_report(setting_level, state.total_games, stats)
+    payout_rate = stats["total_payout"] / (stats["total_games"] * MEDALS_PER_SPIN)
+    if half_width == float("inf"):
+        print(f"Payout Rate 95% CI: not available (needs at least {BATCH_MEANS_MIN} batches of {batch_games:,} games)")
+    else:
+        print(f"Payout Rate 95% CI: {payout_rate:.2%} ± {half_width:.3%} ({len(batch_payouts)} batches of {batch_games:,} games)")
+    if half_width > target_ci:
+        print(f"Target ±{target_ci:.3%} was not reached within {max_spins:,} games.")
+
+USAGE = ("Usage: python3 simulation_runner.py --simulate [games] [setting] [--engine python|numpy|fastforward|jit] [--machines N] [--seed N]\n"
+         "                                    [--checkpoint PATH] [--checkpoint-every N] | --resume PATH\n"
+         "       python3 simulation_runner.py --simulate [max games] [setting] --target-ci 0.001 [--seed N]\n"
+         "       python3 simulation_runner.py --simulate [games] [setting] [--profile PATH] [--bonus-log DIR] [--seed N]")
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(usage=USAGE)
+    parser.add_argument("--simulate", nargs="*", type=int, metavar="N")
+    parser.add_argument("--engine", choices=["python", "numpy", "fastforward", "jit"], default="python")
+    parser.add_argument("--machines", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--checkpoint", metavar="PATH")
+    parser.add_argument("--checkpoint-every", type=int, default=10_000_000, metavar="N")
+    parser.add_argument("--resume", metavar="PATH")
+    parser.add_argument("--target-ci", type=float, metavar="HALF_WIDTH")
+    parser.add_argument("--profile", metavar="PATH")
+    parser.add_argument("--bonus-log", metavar="DIR")
+    return parser.parse_args(argv)
 
 if __name__ == "__main__":
     try:
-        if len(sys.argv) > 1 and sys.argv[1] == '--simulate':
-            total_spins = int(sys.argv[2]) if len(sys.argv) > 2 else 10_000_000
-            setting = int(sys.argv[3]) if len(sys.argv) > 3 else 1
+        args = parse_args(sys.argv[1:])
+        if args.checkpoint_every <= 0 or args.checkpoint_every % 1000000:
+            raise ValueError("--checkpoint-every must be a positive multiple of 1,000,000.")
+        if (args.checkpoint or args.resume) and args.engine != "python":
+            raise ValueError("Checkpoints are only supported by the python engine.")
+        if args.target_ci is not None and (args.engine != "python" or args.checkpoint or args.resume):
+            raise ValueError("--target-ci is only supported by the python engine without checkpoints.")
+        if args.profile and (args.engine != "python" or args.target_ci is not None or args.resume):
+            raise ValueError("--profile is only supported by fixed-length python engine runs.")
+        if args.bonus_log and (args.engine != "python" or args.target_ci is not None or args.resume):
+            raise ValueError("--bonus-log is only supported by fixed-length python engine runs.")
+        if args.target_ci is not None and args.target_ci <= 0:
+            raise ValueError("--target-ci must be positive.")
+        if args.resume:
+            state, setting, total_spins = load_checkpoint(args.resume)
+            print(f"Resuming Setting {setting} from {state.total_games:,} / {total_spins:,} games")
+            run_simulation(total_spins, setting, state=state, checkpoint_path=args.checkpoint or args.resume,
+                           checkpoint_every=args.checkpoint_every)
+        elif args.simulate is not None:
+            total_spins = args.simulate[0] if len(args.simulate) > 0 else 10_000_000
+            setting = args.simulate[1] if len(args.simulate) > 1 else 1
             if setting not in SETTINGS:
                 raise ValueError(f"Setting level {setting} not found.")
-            run_simulation(total_spins, setting)
+            if args.engine == "numpy":
+                # NumPy はこのエンジンを選んだときだけ読み込む
+                import numpy_engine
+                numpy_engine.run_simulation(total_spins, setting, machines=args.machines, seed=args.seed)
+            elif args.engine == "fastforward":
+                import fast_forward
+                fast_forward.run_simulation(total_spins, setting, seed=args.seed)
+            elif args.engine == "jit":
+                # Numba がなければ Python エンジンで実行する
+                import jit_engine
+                jit_engine.run_simulation(total_spins, setting, seed=args.seed)
+            elif args.target_ci is not None:
+                # ゲーム数は上限として扱う
+                run_adaptive_simulation(args.target_ci, setting, total_spins, seed=args.seed)
+            else:
+                profile = bonus_log = None
+                if args.profile:
+                    from instrumentation import EngineProfile
+                    profile = EngineProfile()
+                if args.bonus_log:
+                    from bonus_log import BonusEventLog
+                    bonus_log = BonusEventLog(args.bonus_log)
+                run_simulation(total_spins, setting, checkpoint_path=args.checkpoint, checkpoint_every=args.checkpoint_every,
+                               profile=profile, observers=[bonus_log] if bonus_log is not None else (), seed=args.seed)
+                if profile is not None:
+                    profile.save(args.profile)
+                    print(f"Profile written to {args.profile}")
+                if bonus_log is not None:
+                    bonus_log.close()
+                    print(f"{bonus_log.count:,} bonus events written to {args.bonus_log}")
         else:
              print("Interactive mode is disabled. Please use simulation mode.")
-             print("Usage: python3 simulation_runner.py --simulate [games] [setting]")
-    except (ValueError, IndexError) as e:
+             print(USAGE)
+    except (ValueError, IndexError, OSError, struct.error) as e:
         print(f"Error: Invalid arguments. {e}")
-        print("Usage: python3 simulation_runner.py --simulate [games] [setting]")
\ No newline at end of file
+        print(USAGE)
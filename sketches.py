@@ -0,0 +1,140 @@
+import math
+from array import array
+
+# --- マージ可能なストリーミング集計 ---
+# いずれも値の個数に関係なく一定のメモリで動き、同じパラメーター同士なら merge() で合算できる
+# (並列ワーカーの結果をまとめるときに使う)。
+
+class QuantileSketch:
+    # 対数幅のバケットに数える分位点スケッチ (DDSketch 方式)。分位点の相対誤差は relative_accuracy 以内。
+    # バケット数は値の範囲の対数に比例するだけなので、メダル数程度の範囲なら数千個で収まる。
+    def __init__(self, relative_accuracy=0.01):
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self.gamma)
+        self.positive, self.negative = {}, {}
+        self.zero_count, self.count = 0, 0
+        self.min, self.max = math.inf, -math.inf
+
+    def add(self, value):
+        self.count += 1
+        if value < self.min: self.min = value
+        if value > self.max: self.max = value
+        if value > 0:
+            key = math.ceil(math.log(value) / self._log_gamma)
+            self.positive[key] = self.positive.get(key, 0) + 1
+        elif value < 0:
+            key = math.ceil(math.log(-value) / self._log_gamma)
+            self.negative[key] = self.negative.get(key, 0) + 1
+        else:
+            self.zero_count += 1
+
+    def merge(self, other):
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError("Cannot merge sketches with different relative accuracy.")
+        for mine, theirs in ((self.positive, other.positive), (self.negative, other.negative)):
+            for key, count in theirs.items():
+                mine[key] = mine.get(key, 0) + count
+        self.zero_count += other.zero_count
+        self.count += other.count
+        self.min, self.max = min(self.min, other.min), max(self.max, other.max)
+        return self
+
+    def _value(self, key):
+        return 2 * self.gamma ** key / (self.gamma + 1)
+
+    def quantile(self, q):
+        if self.count == 0:
+            return math.nan
+        rank = q * (self.count - 1)
+        seen = 0
+        # 小さい値から順に: 負のバケット (絶対値の大きい順)、0、正のバケット
+        for key in sorted(self.negative, reverse=True):
+            seen += self.negative[key]
+            if seen > rank:
+                return max(self.min, -self._value(key))
+        seen += self.zero_count
+        if seen > rank:
+            return 0.0
+        for key in sorted(self.positive):
+            seen += self.positive[key]
+            if seen > rank:
+                return min(self.max, self._value(key))
+        return self.max
+
+class Histogram:
+    # 固定幅のヒストグラム。範囲外の値は最初と最後のビンの外側 (underflow / overflow) に数える
+    def __init__(self, low, high, width):
+        self.low, self.high, self.width = low, high, width
+        self.counts = [0] * math.ceil((high - low) / width)
+        self.underflow, self.overflow = 0, 0
+
+    def add(self, value):
+        if value < self.low:
+            self.underflow += 1
+        elif value >= self.high:
+            self.overflow += 1
+        else:
+            self.counts[int((value - self.low) // self.width)] += 1
+
+    def merge(self, other):
+        if (other.low, other.high, other.width) != (self.low, self.high, self.width):
+            raise ValueError("Cannot merge histograms with different bins.")
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.underflow += other.underflow
+        self.overflow += other.overflow
+        return self
+
+    def bins(self):
+        # (下端, 上端, 回数) のリスト
+        return [(self.low + i * self.width, self.low + (i + 1) * self.width, count) for i, count in enumerate(self.counts)]
+
+    def total(self):
+        return sum(self.counts) + self.underflow + self.overflow
+
+class LogTailHistogram:
+    # 0 以上の値のヒストグラム。linear_limit 未満は幅 width の等幅ビン、それ以上は1オクターブ (2倍) を
+    # bins_per_octave 個に分けた対数幅のビンに数える。ビン数は固定なので、マージは配列の足し算で正確に行える。
+    def __init__(self, linear_limit, width=1, bins_per_octave=4, octaves=32):
+        self.linear_limit, self.width = linear_limit, width
+        self.bins_per_octave, self.octaves = bins_per_octave, octaves
+        self.linear_bins = math.ceil(linear_limit / width)
+        self.counts = array("q", bytes(8 * (self.linear_bins + bins_per_octave * octaves)))
+        self.count, self.sum, self.max = 0, 0, 0
+
+    def _index(self, value):
+        if value < self.linear_limit:
+            return int(value // self.width)
+        tail = int(math.log2(value / self.linear_limit) * self.bins_per_octave)
+        return self.linear_bins + min(tail, self.bins_per_octave * self.octaves - 1)
+
+    def add(self, value):
+        self.counts[self._index(value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max: self.max = value
+
+    def merge(self, other):
+        if (other.linear_limit, other.width, other.bins_per_octave, other.octaves) != \
+           (self.linear_limit, self.width, self.bins_per_octave, self.octaves):
+            raise ValueError("Cannot merge histograms with different bins.")
+        for i, count in enumerate(other.counts):
+            if count: self.counts[i] += count
+        self.count += other.count
+        self.sum += other.sum
+        self.max = max(self.max, other.max)
+        return self
+
+    def bin_range(self, index):
+        if index < self.linear_bins:
+            return index * self.width, min((index + 1) * self.width, self.linear_limit)
+        tail = index - self.linear_bins
+        return (self.linear_limit * 2 ** (tail / self.bins_per_octave),
+                self.linear_limit * 2 ** ((tail + 1) / self.bins_per_octave))
+
+    def bins(self):
+        # 件数のあるビンだけを (下端, 上端, 回数) で返す
+        return [(*self.bin_range(i), count) for i, count in enumerate(self.counts) if count]
+
+    def mean(self):
+        return self.sum / self.count if self.count else 0.0
@@ -17,10 +17,21 @@ document.addEventListener('DOMContentLoaded', () => {
 
     // --- Game and History Initialization ---
     let player = { credits: 3000 };
-    let gameState = new GameState(typeof SETTING_LEVEL !== 'undefined' ? SETTING_LEVEL : 1, true);
+    const settingLevel = typeof SETTING_LEVEL !== 'undefined' ? SETTING_LEVEL : 1;
+    let gameState = new GameState(settingLevel, true);
     let creditHistory = [{x: 0, y: 3000}];
     let creditChart;
     let gamesFromPreviousBonusForLog = 0;
+    // サーバー側のゲームセッション (server.py の /api/session)。作成できなければブラウザの game.js で進める
+    let sessionId = null;
+    // グラフはタイルから描くので、advance の推移は受け取らない (points=0)
+    const TRACE_POINTS = 0;
+    // セッションのグラフはサーバーのピラミッドのタイルから描く (game_session.CreditPyramid)。
+    // サーバーは1ゲームごとの値を保持しないので、一番細かいのはレベル CHART_MIN_LEVEL (2ゲームごと) のバケット
+    const CHART_TILE_SIZE = 256, CHART_MAX_BUCKETS = 1024, CHART_TILE_CACHE = 256, CHART_MIN_LEVEL = 1;
+    const tileCache = new Map();  // "level:tile" -> 埋まったタイル
+    let chartView = null;  // [最小ゲーム数, 最大ゲーム数]。null なら全体を表示
+    let chartGeneration = 0;
 
     // --- Chart.js Initialization ---
     function initializeChart() {
@@ -28,7 +39,12 @@ document.addEventListener('DOMContentLoaded', () => {
         const ctx = chartCanvas.getContext('2d');
         creditChart = new Chart(ctx, {
             type: 'line',
-            data: { datasets: [{ data: creditHistory, borderColor: '#ffc107', borderWidth: 2, tension: 0.1, pointRadius: 0 }] },
+            data: { datasets: [
+                { data: creditHistory, borderColor: '#ffc107', borderWidth: 2, tension: 0.1, pointRadius: 0 },
+                // バケット内の最大・最小の帯 (タイル表示のときだけ使う)
+                { data: [], borderWidth: 0, pointRadius: 0, fill: false },
+                { data: [], borderWidth: 0, pointRadius: 0, fill: '-1', backgroundColor: 'rgba(255, 193, 7, 0.25)' },
+            ] },
             options: {
                 animation: false,
                 scales: {
@@ -41,6 +57,10 @@ document.addEventListener('DOMContentLoaded', () => {
     }
 
     function updateChart() {
+        if (sessionId) {
+            updateTileChart();
+            return;
+        }
         // Optimization: only sample data for performance
         const maxPoints = 5000;
         const step = Math.max(1, Math.floor(creditHistory.length / maxPoints));
@@ -52,10 +72,77 @@ document.addEventListener('DOMContentLoaded', () => {
         creditChart.update('none');
     }
 
-    function addBonusToLog(type) {
+    async function fetchTile(level, tile) {
+        const key = `${level}:${tile}`;
+        if (tileCache.has(key)) return tileCache.get(key);
+        const response = await fetch(`/api/session/chart?id=${sessionId}&level=${level}&tile=${tile}`);
+        if (!response.ok) throw new Error(`chart tile ${key}: ${response.status}`);
+        const data = await response.json();
+        // 埋まったタイルは変わらないのでキャッシュする (末尾のタイルは毎回取り直す)
+        if (data.complete) {
+            tileCache.set(key, data);
+            if (tileCache.size > CHART_TILE_CACHE) tileCache.delete(tileCache.keys().next().value);
+        }
+        return data;
+    }
+
+    async function updateTileChart() {
+        // 表示範囲が CHART_MAX_BUCKETS 個以下のバケットに収まるレベルを選び、範囲にかかるタイルだけを取得する。
+        // 描画する点の数はセッションの長さに関係なく一定
+        const generation = ++chartGeneration;
+        const total = gameState.total_games;
+        const [from, to] = chartView || [0, total];
+        const level = Math.max(CHART_MIN_LEVEL, Math.ceil(Math.log2(Math.max(1, to - from + 1) / CHART_MAX_BUCKETS)));
+        const bucketGames = 2 ** level;
+        const firstTile = Math.floor(Math.floor(from / bucketGames) / CHART_TILE_SIZE);
+        const lastTile = Math.floor(Math.floor(Math.min(to, total) / bucketGames) / CHART_TILE_SIZE);
+        let tiles;
+        try {
+            const requests = [];
+            for (let t = firstTile; t <= lastTile; t++) requests.push(fetchTile(level, t));
+            tiles = await Promise.all(requests);
+        } catch (e) {
+            console.error(e);
+            return;
+        }
+        if (generation !== chartGeneration) return;  // 新しい更新が始まっている
+        const last = [], high = [], low = [];
+        tiles.forEach(tile => {
+            tile.last.forEach((y, i) => {
+                const x = Math.min((tile.first_bucket + i + 1) * bucketGames - 1, total);
+                last.push({ x, y });
+                high.push({ x, y: tile.max[i] });
+                low.push({ x, y: tile.min[i] });
+            });
+        });
+        const [lineData, highData, lowData] = creditChart.data.datasets;
+        lineData.data = last;
+        highData.data = high;
+        lowData.data = low;
+        creditChart.options.scales.x.min = chartView ? from : undefined;
+        creditChart.options.scales.x.max = chartView ? to : undefined;
+        creditChart.update('none');
+    }
+
+    function zoomChart(event) {
+        // ホイールでカーソル位置を中心に拡大・縮小、ダブルクリックで全体表示に戻す
+        if (!sessionId) return;
+        event.preventDefault();
+        const total = gameState.total_games;
+        const [from, to] = chartView || [0, total];
+        const center = creditChart.scales.x.getValueForPixel(event.offsetX);
+        const scale = event.deltaY < 0 ? 0.8 : 1.25;
+        const newFrom = Math.max(0, Math.round(center - (center - from) * scale));
+        const newTo = Math.min(total, Math.round(center + (to - center) * scale));
+        if (newTo - newFrom < 16) return;  // これ以上は拡大しない
+        chartView = newFrom === 0 && newTo === total ? null : [newFrom, newTo];
+        updateTileChart();
+    }
+
+    function addBonusToLog(type, game = gameState.total_games) {
         const li = document.createElement('li');
         const bonusClass = type === 'BIG' ? 'bonus-big' : 'bonus-reg';
-        li.innerHTML = `<span class="${bonusClass}">${type}</span> at game ${gameState.total_games} (${gamesFromPreviousBonusForLog}G)`;
+        li.innerHTML = `<span class="${bonusClass}">${type}</span> at game ${game} (${gamesFromPreviousBonusForLog}G)`;
         bonusHistoryLogEl.prepend(li);
     }
     
@@ -99,7 +186,7 @@ document.addEventListener('DOMContentLoaded', () => {
                     hibiscusImg.src = "images/hibiscus_on.svg";
                     hibiscusImg.classList.add('lit');
                     gamesFromPreviousBonusForLog = event.games_since_bonus;
-                    addBonusToLog(event.type);
+                    addBonusToLog(event.type, event.game);
                     showMessage(`🎉 ${event.type} BONUS START! 🎉`, true);
                     bonusHitInSpin = true;
                     break;
@@ -117,7 +204,7 @@ document.addEventListener('DOMContentLoaded', () => {
                 case '1G_REN':
                     hibiscusImg.src = "images/hibiscus_on.svg";
                     hibiscusImg.classList.add('lit');
-                    addBonusToLog(event.type);
+                    addBonusToLog(event.type, event.game);
                     showMessage(`⚡️ 1G-REN! ${event.type} BONUS! ⚡️`, true);
                     bonusHitInSpin = true;
 
@@ -142,8 +229,88 @@ document.addEventListener('DOMContentLoaded', () => {
         return bonusHitInSpin;
     }
 
+    // --- Server Session ---
+    async function startSession() {
+        try {
+            const response = await fetch(`/api/session/new?setting=${settingLevel}&credits=${player.credits}`, { method: 'POST' });
+            if (!response.ok) return;
+            const result = await response.json();
+            sessionId = result.id;
+            applySessionState(result.state);
+            updateUI();
+            updateChart();
+        } catch (e) {
+            // サーバーなしで開いた場合など。ブラウザのエンジンで続ける
+        }
+    }
+
+    async function advanceSession(until) {
+        // セッションが期限切れ (404) なら null を返し、以降はブラウザのエンジンで進める。
+        // それ以外の失敗 (状態と合わない要求、通信エラー) では { error } を返し、セッションは保持する
+        try {
+            const response = await fetch(`/api/session/advance?id=${sessionId}&until=${until}&points=${TRACE_POINTS}`, { method: 'POST' });
+            if (response.ok) return await response.json();
+            if (response.status === 404) {
+                sessionId = null;
+                return null;
+            }
+            const body = await response.json().catch(() => ({}));
+            return { error: body.error || `Server error (${response.status})`, state: body.state };
+        } catch (e) {
+            return { error: "Connection error" };
+        }
+    }
+
+    function applySessionState(state) {
+        player.credits = state.credits;
+        for (const key of ['total_games', 'games_since_bonus', 'current_mode', 'is_in_bonus_at', 'current_bonus_type',
+                           'bonus_games_remaining', 'renchan_count', 'renchan_payout']) {
+            gameState[key] = state[key];
+        }
+    }
+
+    async function runSessionAdvance(until) {
+        const result = await advanceSession(until);
+        if (!result) {
+            // ブラウザのエンジンに切り替える。以降のグラフはここから描く
+            creditHistory = [{ x: gameState.total_games, y: player.credits }];
+            creditChart.data.datasets.forEach((dataset, i) => { dataset.data = i === 0 ? creditHistory : []; });
+            creditChart.options.scales.x.min = creditChart.options.scales.x.max = undefined;
+            return false;
+        }
+        if (result.error) {
+            if (result.state) applySessionState(result.state);
+            showMessage(result.error);
+            updateUI();
+            setButtonsDisabled(false);
+            return true;
+        }
+        applySessionState(result.state);
+        if (result.events.length === 0) {
+            if (!gameState.is_in_bonus_at) showMessage("...");
+        } else {
+            processEvents(result.events);
+        }
+        updateUI();
+        updateChart();
+        if (result.state.out_of_credits) {
+            showMessage("Not enough credits!");
+        } else {
+            setButtonsDisabled(false);
+        }
+        return true;
+    }
+
     async function handleSpin() {
         if (player.credits < MEDALS_PER_SPIN) { return; }
+        if (sessionId) {
+            setButtonsDisabled(true);
+            if (!gameState.is_in_bonus_at) {
+                hibiscusImg.src = "images/hibiscus_off.svg";
+                hibiscusImg.classList.remove('lit');
+            }
+            if (await runSessionAdvance('spin')) return;
+        }
         setButtonsDisabled(true);
         if (!gameState.is_in_bonus_at) {
             hibiscusImg.src = "images/hibiscus_off.svg";
@@ -170,12 +337,13 @@ document.addEventListener('DOMContentLoaded', () => {
         setButtonsDisabled(false);
     }
 
-    function handleSkip() {
+    async function handleSkip() {
         if (player.credits < MEDALS_PER_SPIN) { return; }
         setButtonsDisabled(true);
         hibiscusImg.src = "images/hibiscus_off.svg";
         hibiscusImg.classList.remove('lit');
         showMessage("Skipping to next bonus...");
+        if (sessionId && await runSessionAdvance('bonus')) return;
 
         function runSkipLoop() {
             for (let i = 0; i < 1000; i++) {
@@ -207,10 +375,11 @@ document.addEventListener('DOMContentLoaded', () => {
         runSkipLoop();
     }
 
-    function handleSkipAT() {
+    async function handleSkipAT() {
         if (!gameState.is_in_bonus_at) return;
         setButtonsDisabled(true);
         showMessage("Skipping AT...");
+        if (sessionId && await runSessionAdvance('at_end')) return;
 
         function runATSkipLoop() {
             if (!gameState.is_in_bonus_at) {
@@ -235,6 +404,8 @@ document.addEventListener('DOMContentLoaded', () => {
         runATSkipLoop();
     }
 
+    chartCanvas.addEventListener('wheel', zoomChart, { passive: false });
+    chartCanvas.addEventListener('dblclick', () => { chartView = null; if (sessionId) updateTileChart(); });
     spinButton.addEventListener('click', handleSpin);
     skipButton.addEventListener('click', handleSkip);
     skipATButton.addEventListener('click', handleSkipAT);
@@ -244,4 +415,5 @@ document.addEventListener('DOMContentLoaded', () => {
 
     updateUI();
     initializeChart();
+    startSession();
 });